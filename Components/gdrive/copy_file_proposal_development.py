@@ -1,7 +1,6 @@
 '''Copies document templates into project folders for the Lead Validation phase'''
 
 from os import environ as env
-from operator import eq, ne
 import logging
 import json
 import sys
@@ -9,10 +8,10 @@ from datetime import datetime
 
 import boto3
 from botocore.exceptions import ClientError
-from pydrive.auth import GoogleAuth, AuthError
-from pydrive.drive import GoogleDrive
-from pydrive.files import ApiRequestError, FileNotUploadedError
 from pydrive.settings import InvalidConfigError
+from drive_auth import DRIVE_CLIENTS, AuthError
+from drive_links import LINKS
+from drive_query import find_children
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.WARNING)
@@ -45,12 +44,9 @@ class GDriveBaseError(Exception):
 
 
 def init_auth(settings_file='settings.yaml'):
-    '''Initialize GoogleDrive auth object'''
+    '''Return the GoogleDrive client, authorized once per container'''
     try:
-        gauth = GoogleAuth(
-            settings_file=settings_file
-        )
-        gauth.ServiceAuth()
+        drive = DRIVE_CLIENTS.get(settings_file)
     except AuthError as erra:
         LOGGER.exception(erra)
         exc_info = sys.exc_info()
@@ -60,7 +56,7 @@ def init_auth(settings_file='settings.yaml'):
         exc_info = sys.exc_info()
         raise GDriveBaseError(errc).with_traceback(exc_info[2])
 
-    return GoogleDrive(gauth)
+    return drive
 
 
 def get_resource_request_link(credential_path):
@@ -119,8 +115,9 @@ def copy_file(drive, source_id, dest_title, parent_id):
         }
     try:
         file_data = drive.auth.service.files().copy(
-            fileId=source_id, body=copied_file).execute()
-        return drive.CreateFile({'id': file_data['id']})
+            fileId=source_id, body=copied_file, fields='id,alternateLink').execute()
+        LINKS.remember(file_data)
+        return file_data
     except Exception as error:
         LOGGER.exception(error)
         exc_info = sys.exc_info()
@@ -165,38 +162,22 @@ def copy_files_from_doclist(drive, stage_doc_list):
 def get_project_sub_folder_id(drive, parent_folder_id, customer_name, project_name, folder_name):
     '''Return sales project folder id by iterating through root folder
        down to customer folder then Sales folder and finally project folder'''
-    folder_list = list_file_object(drive, parent_folder_id, directory_only=True)
-    match = [x for x in folder_list if x['title'] == customer_name]
+    match = find_children(drive, parent_folder_id, customer_name, directory_only=True)
 
     if match:
         folder_id = match[0]['id']
-        customer_folder_list = list_file_object(drive, folder_id, directory_only=True)
-        sales_match = [x for x in customer_folder_list if x['title'] == '_SALES']
+        sales_match = find_children(drive, folder_id, '_SALES', directory_only=True)
         if sales_match:
             sales_folder_id = sales_match[0]['id']
-            sales_folder_list = list_file_object(drive, sales_folder_id, directory_only=True)
-            project_match = [x for x in sales_folder_list if x['title'] == 'Project Name: {}'.format(project_name)]
+            project_match = find_children(drive, sales_folder_id, 'Project Name: {}'.format(project_name), directory_only=True)
             if project_match:
                 project_folder_id = project_match[0]['id']
-                project_folder_list = list_file_object(drive, project_folder_id, directory_only=True)
-                meeting_note_match = [x for x in project_folder_list if x['title'] == folder_name]
+                meeting_note_match = find_children(drive, project_folder_id, folder_name, directory_only=True)
                 return meeting_note_match[0]['id']
     else:
         raise GDriveBaseError('{} folder does not exist'.format(folder_name))
 
 
-def list_file_object(drive, folder_id, directory_only=False):
-    '''Iterates over a folder and returns list of all child objects'''
-    _q = {'q': "'{}' in parents and trashed=false".format(folder_id)}
-    file_object_list = drive.ListFile(_q).GetList()
-    op = {True: eq, False: ne}[directory_only]
-    file_objects = [
-        x for x in file_object_list
-        if op(x['mimeType'], 'application/vnd.google-apps.folder')
-    ]
-    return [{"id": fld["id"], "title": fld["title"]} for fld in file_objects]
-
-
 def format_response(message):
     ''' Format the message to be returned as the response body'''
     message = {'message': message}
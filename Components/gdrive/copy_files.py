@@ -1,7 +1,6 @@
 '''Copies document templates into project folders for the Lead In phase'''
 
 from os import environ as env
-from operator import eq, ne
 import logging
 import json
 import sys
@@ -13,10 +12,12 @@ import boto3
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 from googleapiclient.errors import HttpError
-from pydrive.auth import GoogleAuth, AuthError
-from pydrive.drive import GoogleDrive
-from pydrive.files import ApiRequestError, FileNotUploadedError
 from pydrive.settings import InvalidConfigError
+from doc_templates import DocTemplateCache
+from drive_auth import DRIVE_CLIENTS, AuthError
+from drive_links import LINKS
+from drive_pool import DRIVE_POOLS
+from drive_query import ChildIndex
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.WARNING)
@@ -24,6 +25,7 @@ LOGGER.setLevel(logging.WARNING)
 GDRIVE_SNS_TOPIC_ARN = env.get('GDRIVE_SNS_TOPIC_ARN')
 SNS = boto3.client('sns')
 DDB = boto3.resource('dynamodb', region_name='us-east-1')
+DOC_TEMPLATES = DocTemplateCache()
 
 fiscalyear.START_MONTH = 4
 FISCAL_YEAR = FiscalDateTime.now()
@@ -54,12 +56,9 @@ class GDriveFolderNotFoundError(WorthRetryingException):
 
 
 def init_auth(settings_file='settings.yaml'):
-    '''Initialize GoogleDrive auth object'''
+    '''Return the GoogleDrive client, authorized once per container'''
     try:
-        gauth = GoogleAuth(
-            settings_file=settings_file
-        )
-        gauth.ServiceAuth()
+        drive = DRIVE_CLIENTS.get(settings_file)
     except AuthError as erra:
         exc_info = sys.exc_info()
         raise GDriveAuthError(erra).with_traceback(exc_info[2])
@@ -67,7 +66,7 @@ def init_auth(settings_file='settings.yaml'):
         exc_info = sys.exc_info()
         raise GDriveBaseError(errc).with_traceback(exc_info[2])
 
-    return GoogleDrive(gauth)
+    return drive
 
 
 def build_sns_message(message, copied_file_links, folder_ids=None):
@@ -119,8 +118,8 @@ def publish_sns_message(sns_topic_arn, message, attributes):
     return resp
 
 
-def copy_file(drive, source_id, dest_title, parent_id):
-    '''Copy an existing file'''
+def copy_file(drive, source_id, dest_title, parent_id, http=None):
+    '''Copy an existing file. Pass http when calling from a worker thread'''
     copied_file = {
         'title': dest_title,
         'parents': [
@@ -131,8 +130,9 @@ def copy_file(drive, source_id, dest_title, parent_id):
         }
     try:
         file_data = drive.auth.service.files().copy(
-            fileId=source_id, body=copied_file).execute()
-        return drive.CreateFile({'id': file_data['id']})
+            fileId=source_id, body=copied_file, fields='id,alternateLink').execute(http=http)
+        LINKS.remember(file_data)
+        return file_data
     except HttpError as errh:
         raise errh
     except Exception as error:
@@ -141,22 +141,14 @@ def copy_file(drive, source_id, dest_title, parent_id):
 
 
 def get_doc_template_ids(stage):
-    '''Retrieve Doc Template IDs for this stage from DynamoDB'''
-    doc_templates = {}
-    table = DDB.Table('gdrive-doc-templates')
-
+    '''Retrieve Doc Template IDs for this stage, from DynamoDB only when the
+       templates have changed since the last invocation'''
     try:
-        response = table.query(
-            KeyConditionExpression=Key('stage').eq(stage)
-        )
+        return DOC_TEMPLATES.get(stage)
     except ClientError as errc:
         exc_info = sys.exc_info()
         raise Exception(errc).with_traceback(exc_info[2])
 
-    for i in response['Items']:
-        doc_templates.update({i['tag'] : i['id']})
-    return doc_templates
-
 
 def get_folder_ids(message):
     '''Retrieves folder_ids dict for customer project from dynamodb'''
@@ -235,56 +227,54 @@ def get_docs_to_copy(message, doc_templates, stage_name, folder_ids):
         raise GDriveBaseError(errk)
 
 
+def copy_doc(drive, title, info, index, http=None):
+    '''Copy one template to its destination unless a copy is already there.
+       Returns the link to the document either way'''
+    match = index.lookup(info['dest'], title, http=http)
+    if match:
+        return LINKS.get(drive, match[0]['id'], http=http)
+    file_data = copy_file(drive, info['id'], title, info['dest'], http=http)
+    index.add(info['dest'], {'id': file_data['id'], 'title': title})
+    return file_data['alternateLink']
+
+
 def copy_files_from_doclist(drive, stage_doc_list, message):
-    '''Iterate over doc list and copy each file to destination folder'''
+    '''Copy every file in the doc list to its destination folder, the
+       documents side by side on a DrivePool. Each destination is listed
+       once, however many documents go there'''
+    pool = DRIVE_POOLS.get(drive)
+    index = ChildIndex(drive)
+
+    def run(doc, http):
+        (title, info) = doc
+        try:
+            return copy_doc(drive, title, info, index, http=http), None
+        except Exception as error:
+            return None, error
+
     copied_file_links = {}
     errors = []
-    for (title, info) in stage_doc_list.items():
-        match = check_file_exists(drive, info['dest'], title)
-        if not match:
-            try:
-                result = copy_file(drive, info['id'], title, info['dest'])
-                copied_file_links.update({info['field_name'] : result['alternateLink']})
-            except HttpError as errh:
-                if errh.resp.status == 404:
-                    sns_message = build_sns_message(message, copied_file_links)
-                    message_attributes = build_message_attributes('folder_missing', 'error')
-                    publish_sns_message(GDRIVE_SNS_TOPIC_ARN, sns_message, message_attributes)
-                    raise GDriveFolderNotFoundError(errh)
-            except Exception as error:
-                LOGGER.exception(error)
-                errors.append(error)
+    folder_missing = None
+    for ((title, info), (link, error)) in zip(stage_doc_list.items(), pool.map(run, stage_doc_list.items())):
+        if error is None:
+            copied_file_links.update({info['field_name'] : link})
+        elif isinstance(error, HttpError) and error.resp.status == 404:
+            folder_missing = folder_missing or error
         else:
-            file_object = drive.CreateFile({'id': match[0]['id']})
-            copied_file_links.update({info['field_name'] : file_object['alternateLink']})
+            LOGGER.exception(error, exc_info=error)
+            errors.append(error)
+
+    if folder_missing is not None:
+        sns_message = build_sns_message(message, copied_file_links)
+        message_attributes = build_message_attributes('folder_missing', 'error')
+        publish_sns_message(GDRIVE_SNS_TOPIC_ARN, sns_message, message_attributes)
+        raise GDriveFolderNotFoundError(folder_missing)
     if errors:
         print('Errors received: {}'.format(errors))
 
     return copied_file_links
 
 
-def list_file_object(drive, folder_id, directory_only=False):
-    '''Iterates over a folder and returns list of all child objects'''
-    _q = {'q': "'{}' in parents and trashed=false".format(folder_id)}
-    file_object_list = drive.ListFile(_q).GetList()
-    op = {True: eq, False: ne}[directory_only]
-    file_objects = [
-        x for x in file_object_list
-        if op(x['mimeType'], 'application/vnd.google-apps.folder')
-    ]
-    return [{'id': fld['id'], 'title': fld['title']} for fld in file_objects]
-
-
-def check_file_exists(drive, parent_folder_id, title):
-    '''Check if a folder with the given title exists within the parent folder'''
-    folder_list = list_file_object(
-        drive,
-        parent_folder_id
-    )
-    match = [x for x in folder_list if x['title'] == title]
-    return match
-
-
 def format_response(message):
     ''' Format the message to be returned as the response body '''
     message = {'message': message}
@@ -1,25 +1,38 @@
 '''Create GDrive folder structure for a new customer and/or project'''
 
 from os import environ as env
-from operator import eq, ne
 import logging
 import json
 import sys
 
 import boto3
 from botocore.exceptions import ClientError
-from pydrive.auth import GoogleAuth, AuthError
-from pydrive.drive import GoogleDrive
-from pydrive.files import ApiRequestError, FileNotUploadedError
 from pydrive.settings import InvalidConfigError
+from drive_auth import DRIVE_CLIENTS, AuthError
+from drive_batch import insert_folder_request
+from drive_links import LINKS
+from drive_query import find_children
+from folder_cache import FolderIdCache
+from folder_layout import CUSTOMER_LAYOUT, PROJECT_FOLDER, apply_plan, plan_layout, render_layout
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.WARNING)
 
 GDRIVE_SNS_TOPIC_ARN = env.get('GDRIVE_SNS_TOPIC_ARN')
 GDRIVE_PARENT_FOLDER_ID = env.get('GDRIVE_PARENT_FOLDER_ID')
+# Only describe the folders a run would create, see describe_folder_structure
+GDRIVE_DRY_RUN = env.get('GDRIVE_DRY_RUN', 'false').lower() == 'true'
 SNS = boto3.client('sns')
 DDB = boto3.resource('dynamodb', region_name='us-east-1')
+FOLDER_IDS = FolderIdCache()
+
+# Where each customer child folder goes in the folder_ids map
+FOLDER_ID_KEYS = {
+    '_SALES': 'SalesFolder',
+    '_ENGINEERING': 'EngineeringFolder',
+    '_DELIVERY': 'DeliveryFolder',
+    '_ACCOUNT': 'AccountFolder'
+}
 
 
 class WorthRetryingException(Exception):
@@ -48,12 +61,9 @@ class GDriveAuthError(WorthRetryingException):
 
 
 def init_auth(settings_file='settings.yaml'):
-    '''Initialize GoogleDrive auth object'''
+    '''Return the GoogleDrive client, authorized once per container'''
     try:
-        gauth = GoogleAuth(
-            settings_file=settings_file
-        )
-        gauth.ServiceAuth()
+        drive = DRIVE_CLIENTS.get(settings_file)
     except AuthError as erra:
         exc_info = sys.exc_info()
         raise GDriveAuthError(erra).with_traceback(exc_info[2])
@@ -61,7 +71,7 @@ def init_auth(settings_file='settings.yaml'):
         exc_info = sys.exc_info()
         raise GDriveBaseError(errc).with_traceback(exc_info[2])
 
-    return GoogleDrive(gauth)
+    return drive
 
 
 def build_sns_message(message, root_customer_folder_link, sow_folder_link, project_folder_ids):
@@ -121,134 +131,54 @@ def publish_sns_message(sns_topic_arn, message, attributes):
 def create_folder(drive, parent_folder_id, folder_name):
     '''Create a single folder in GDrive and return folder id'''
     try:
-        folder = drive.CreateFile(dict(
-            title=folder_name,
-            parents=[dict(id=parent_folder_id)],
-            mimeType='application/vnd.google-apps.folder'
-        ))
-        folder.Upload()
+        folder = insert_folder_request(drive, parent_folder_id, folder_name).execute()
     except Exception as error:
         exc_info = sys.exc_info()
         raise ExternalAPIFailed(error).with_traceback(exc_info[2])
 
-    # try:
-    #     folder.Upload()
-    # except FileNotUploadedError as erru:
-    #     LOGGER.exception(erru)
-    # except ApiRequestError:
-    #     pass
+    LINKS.remember(folder)
 
     return folder['id']
 
 
-
-def create_customer_folder_structure(drive, parent_folder_id, customer, project):
-    '''Creates _SALES, _ENGINEERING, _DELIVERY folders in the customer folder'''
+def create_folder_structure(drive, customer_folder_id, project, new_customer=False):
+    '''Creates whatever CUSTOMER_LAYOUT folders are missing from the customer
+       folder, the project folders included, and returns the folder_ids map.
+       A customer folder created by this run is not listed'''
+    layout = render_layout(CUSTOMER_LAYOUT, project=project)
+    project_title = PROJECT_FOLDER.format(project=project)
     try:
-        # Create a new folder named Customer in the root parent folder.
-        customer_folder_id = create_folder(drive, parent_folder_id, customer)
-        file_object = drive.CreateFile({'id': customer_folder_id})
-        root_customer_folder_link = file_object['alternateLink']
-
-        # Create _SALES, _ENGINEERING, _DELIVERY, _ACCOUNT folders in the root
-        # customer folder. Store folderIds in variables
-        child_ids = {}
-        for child in ['_SALES', '_ENGINEERING', '_DELIVERY', '_ACCOUNT']:
-            child_folder_id = create_folder(drive, customer_folder_id, child)
-            child_ids[child] = child_folder_id
+        plan = plan_layout(drive, customer_folder_id, layout, root_empty=new_customer)
+        print('Folder plan: {}'.format(plan.describe()))
+        paths = apply_plan(drive, plan)
+
+        folder_ids = {'CustomerFolderId': customer_folder_id}
+        for (name, children) in layout.items():
+            folder_ids[FOLDER_ID_KEYS[name]] = {'RootId': paths[(name,)]}
+            if project_title in children:
+                folder_ids[FOLDER_ID_KEYS[name]].update({
+                    'ProjectId': paths[(name, project_title)],
+                    'SubFolders': {
+                        title: paths[(name, project_title, title)] for title in children[project_title]
+                    }
+                })
     except Exception as error:
         LOGGER.exception(error)
         exc_info = sys.exc_info()
-        raise GDriveBaseError(error).with_traceback(exc_info[2])
+        raise ExternalAPIFailed(error).with_traceback(exc_info[2])
 
-    return customer_folder_id, child_ids, root_customer_folder_link
+    return folder_ids
 
 
-def create_project_folder_structure(drive, parent_folder_id, customer, project, customer_child_ids):
-    '''Creates Project Name: Project folder in each of the child folders
-       Then creates required project folders
-       Returns dict of project folder ids as well as the sow folder link'''
-    # TODO: Refactor in to separate method
-    project_folder_ids = {}
-    try:
-        for (name, child_id) in customer_child_ids.items():
-            if name != '_ACCOUNT':
-                match = check_child_folder_exists(drive, child_id, 'Project Name: {}'.format(project))
-                if not match:
-                    folder_id = create_folder(drive, child_id, 'Project Name: {}'.format(project))
-                    project_folder_ids.update({name : {'ProjectId': folder_id, 'SubFolders': {}}})
-                else:
-                    project_folder_ids.update({name : {'ProjectId': match[0]['id'], 'SubFolders': {}}})
-
-        # In _SALES/PROJECT_NAME, create these folders: APN Portal Admin, Deliverables, Meeting_Notes, SOW
-        sales_folders = ['APN Portal Admin', 'Deliverables', 'Meeting_Notes', 'SOW']
-
-        # Check if any folders have already been created
-        sales_child_list = list_file_object(drive, project_folder_ids['_SALES']['ProjectId'], directory_only=True)
-        for folder in sales_child_list:
-            project_folder_ids['_SALES']['SubFolders'].update({folder['title'] : folder['id']})
-
-        for folder in sales_folders:
-            if folder not in [x['title'] for x in sales_child_list]:
-                folder_id = create_folder(drive, project_folder_ids['_SALES']['ProjectId'], folder)
-                project_folder_ids['_SALES']['SubFolders'].update({folder : folder_id})
-
-        # In _ENGINEERING/PROJECT_NAME, create these folders: Deliverables, Provided_Documents
-        engineering_folders = ['Deliverables', 'Provided_Documents']
-
-        # Check if any folders have already been created
-        eng_child_list = list_file_object(drive, project_folder_ids['_ENGINEERING']['ProjectId'], directory_only=True)
-        for folder in eng_child_list:
-            project_folder_ids['_ENGINEERING']['SubFolders'].update({folder['title'] : folder['id']})
-
-        for folder in engineering_folders:
-            if folder not in [x['title'] for x in eng_child_list]:
-                folder_id = create_folder(drive, project_folder_ids['_ENGINEERING']['ProjectId'], folder)
-                project_folder_ids['_ENGINEERING']['SubFolders'].update({folder : folder_id})
-
-        # In _DELIVERY/PROJECT_NAME, create these folders:
-        delivery_folders = ['Weekly_Action_Reports', 'Engagement_Data_Reports', 'Communications', 'Onboarding', 'Who’s Who']
-
-        # Check if any folders have already been created
-        deliv_child_list = list_file_object(drive, project_folder_ids['_DELIVERY']['ProjectId'], directory_only=True)
-        for folder in deliv_child_list:
-            project_folder_ids['_DELIVERY']['SubFolders'].update({folder['title'] : folder['id']})
-
-        for folder in delivery_folders:
-            if folder not in [x['title'] for x in deliv_child_list]:
-                folder_id = create_folder(drive, project_folder_ids['_DELIVERY']['ProjectId'], folder)
-                project_folder_ids['_DELIVERY']['SubFolders'].update({folder : folder_id})
-
-        sow_file_object = drive.CreateFile({'id': project_folder_ids['_SALES']['SubFolders']['SOW']})
-        folder_ids = {
-            'CustomerFolderId': parent_folder_id,
-            'SalesFolder': {
-                'RootId': customer_child_ids['_SALES'],
-                'ProjectId': project_folder_ids['_SALES']['ProjectId'],
-                'SubFolders': project_folder_ids['_SALES']['SubFolders']
-            },
-            'DeliveryFolder': {
-                'RootId': customer_child_ids['_DELIVERY'],
-                'ProjectId': project_folder_ids['_DELIVERY']['ProjectId'],
-                'SubFolders': project_folder_ids['_DELIVERY']['SubFolders']
-            },
-            'EngineeringFolder': {
-                'RootId': customer_child_ids['_ENGINEERING'],
-                'ProjectId': project_folder_ids['_ENGINEERING']['ProjectId'],
-                'SubFolders': project_folder_ids['_ENGINEERING']['SubFolders']
-            },
-            'AccountFolder': {
-                'RootId': customer_child_ids['_ACCOUNT']
-            }
-        }
-
-
-    except Exception as error:
-        LOGGER.exception(error)
-        exc_info = sys.exc_info()
-        raise ExternalAPIFailed(error).with_traceback(exc_info[2])
-
-    return folder_ids, sow_file_object['alternateLink']
+def describe_folder_structure(drive, customer_name, project):
+    '''Dry run of the folder set up: describe the folders and Drive batch
+       calls a run would make for the project, without creating anything'''
+    layout = render_layout(CUSTOMER_LAYOUT, project=project)
+    match = check_child_folder_exists(drive, GDRIVE_PARENT_FOLDER_ID, customer_name)
+    if match:
+        return plan_layout(drive, match[0]['id'], layout).describe()
+    plan = plan_layout(drive, None, layout, root_empty=True)
+    return 'customer folder {} to create, then {}'.format(customer_name, plan.describe())
 
 
 def update_customers_table(customer_name, project_name, folder_ids):
@@ -271,41 +201,6 @@ def update_customers_table(customer_name, project_name, folder_ids):
         raise DynamoDBError(error).with_traceback(exc_info[2])
 
 
-def get_customer_child_folders(drive, folder_id):
-    '''Returns dict of top-level child folders for a customer and the
-       customer root folder link'''
-    customer_child_folders = ['_SALES', '_ENGINEERING', '_DELIVERY', '_ACCOUNT']
-    customer_folder_list = list_file_object(
-        drive, folder_id, directory_only=True)
-    customer_child_ids = {}
-
-    for f in customer_child_folders:
-        # check if the correct folders exist; create them if not
-        if f not in [x['title'] for x in customer_folder_list]:
-            new_folder_id = create_folder(drive, folder_id, f)
-            customer_child_ids.update({f: new_folder_id})
-
-    for f in customer_folder_list:
-        customer_child_ids.update({f['title'] : f['id']})
-
-    # get customer root folder link
-    file_object = drive.CreateFile({'id': folder_id})
-
-    return customer_child_ids, file_object['alternateLink']
-
-
-def list_file_object(drive, folder_id, directory_only=False):
-    '''Iterates over a folder and returns list of all child objects'''
-    _q = {'q': "'{}' in parents and trashed=false".format(folder_id)}
-    file_object_list = drive.ListFile(_q).GetList()
-    op = {True: eq, False: ne}[directory_only]
-    file_objects = [
-        x for x in file_object_list
-        if op(x['mimeType'], 'application/vnd.google-apps.folder')
-    ]
-    return [{'id': fld['id'], 'title': fld['title']} for fld in file_objects]
-
-
 def format_response(message):
     ''' Format the message to be returned as the response body '''
     message = {'message': message}
@@ -314,13 +209,20 @@ def format_response(message):
 
 def check_child_folder_exists(drive, parent_folder_id, title):
     '''Check if a folder with the given title exists within the parent folder'''
-    folder_list = list_file_object(
-        drive,
-        parent_folder_id,
-        directory_only=True
-    )
-    match = [x for x in folder_list if x['title'] == title]
-    return match
+    return find_children(drive, parent_folder_id, title, directory_only=True)
+
+
+def has_project_layout(folder_ids, project):
+    '''Check stored folder_ids include every folder CUSTOMER_LAYOUT asks for'''
+    layout = render_layout(CUSTOMER_LAYOUT, project=project)
+    project_title = PROJECT_FOLDER.format(project=project)
+    for (name, children) in layout.items():
+        stored = folder_ids.get(FOLDER_ID_KEYS[name])
+        if stored is None:
+            return False
+        if project_title in children and any(title not in stored.get('SubFolders', {}) for title in children[project_title]):
+            return False
+    return True
 
 
 def lambda_handler(event, context):
@@ -341,19 +243,34 @@ def lambda_handler(event, context):
         # Initialize GDrive authentication
         drive = init_auth()
 
-        # Check if a Customer root folder exists
-        match = check_child_folder_exists(drive, GDRIVE_PARENT_FOLDER_ID, customer_name)
-        if match:
-            customer_folder_id = match[0]['id']
-            # get customer child folders and root customer folder link
-            customer_child_ids, root_customer_folder_link = get_customer_child_folders(drive, customer_folder_id)
+        if GDRIVE_DRY_RUN or message.get('DryRun'):
+            plan = describe_folder_structure(drive, customer_name, project_name)
+            print('Dry run: {}'.format(plan))
+            response['body'] = format_response(plan)
+            return response
+
+        # A project set up by an earlier run only needs its stored ids checked
+        resolved = FOLDER_IDS.resolve(drive, customer_name, project_name)
+        if resolved and has_project_layout(resolved[0], project_name):
+            project_folder_ids, links = resolved
+            root_customer_folder_link = links[project_folder_ids['CustomerFolderId']]
+            sow_folder_link = links[project_folder_ids['SalesFolder']['SubFolders']['SOW']]
         else:
-            customer_folder_id, customer_child_ids, root_customer_folder_link = create_customer_folder_structure(drive, GDRIVE_PARENT_FOLDER_ID, customer_name, project_name)
-
-        project_folder_ids, sow_folder_link = create_project_folder_structure(drive, customer_folder_id, customer_name, project_name, customer_child_ids)
-
-        # Update Gdrive Customers DynamoDB Table
-        update_customers_table(customer_name, project_name, project_folder_ids)
+            # Check if a Customer root folder exists
+            match = check_child_folder_exists(drive, GDRIVE_PARENT_FOLDER_ID, customer_name)
+            if match:
+                customer_folder_id = match[0]['id']
+            else:
+                customer_folder_id = create_folder(drive, GDRIVE_PARENT_FOLDER_ID, customer_name)
+
+            project_folder_ids = create_folder_structure(drive, customer_folder_id, project_name,
+                                                         new_customer=not match)
+            root_customer_folder_link = LINKS.get(drive, customer_folder_id)
+            sow_folder_link = LINKS.get(drive, project_folder_ids['SalesFolder']['SubFolders']['SOW'])
+
+            # Update Gdrive Customers DynamoDB Table
+            update_customers_table(customer_name, project_name, project_folder_ids)
+            FOLDER_IDS.remember(customer_name, project_name, project_folder_ids)
 
         # Send SNS message with customer_name,project_name,RootCustomerFolderLink
         # and SOWLink to Gdrive SNS topic
@@ -0,0 +1,100 @@
+'''In-process copy of gdrive-doc-templates, reloaded only after
+   update_doc_templates has bumped the table's version item'''
+
+from os import environ as env
+import time
+
+import boto3
+
+GDRIVE_DOC_TEMPLATES_TABLE = env.get('GDRIVE_DOC_TEMPLATES_TABLE', 'gdrive-doc-templates')
+DOC_TEMPLATES_VERSION_TTL = int(env.get('DOC_TEMPLATES_VERSION_TTL', '60'))
+# Kept in the templates table itself, under a stage no template uses
+VERSION_KEY = {'stage': '_version', 'tag': '_version'}
+DDB = boto3.resource('dynamodb', region_name='us-east-1')
+
+
+def bump_version(table_name=GDRIVE_DOC_TEMPLATES_TABLE):
+    '''Tell every DocTemplateCache the templates changed. Returns the new version'''
+    response = DDB.Table(table_name).update_item(
+        Key=VERSION_KEY,
+        UpdateExpression='ADD #version :one',
+        ExpressionAttributeNames={'#version': 'version'},
+        ExpressionAttributeValues={':one': 1},
+        ReturnValues='UPDATED_NEW'
+    )
+    return response['Attributes']['version']
+
+
+def scan_templates(table, **kwargs):
+    '''Yield every template row of table, leaving out the version item'''
+    while True:
+        response = table.scan(**kwargs)
+        for item in response['Items']:
+            if item['stage'] != VERSION_KEY['stage']:
+                yield item
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def sync_templates(rows, table_name=GDRIVE_DOC_TEMPLATES_TABLE):
+    '''Make the table hold exactly rows, each a dict with stage, tag, title
+       and id. Only rows that differ are written and rows for templates that
+       are gone are deleted, 25 to a BatchWriteItem. Returns the number of
+       puts and deletes'''
+    table = DDB.Table(table_name)
+    wanted = {(row['stage'], row['tag']): row for row in rows}
+    existing = {(item['stage'], item['tag']): item for item in scan_templates(table)}
+
+    puts = [row for (key, row) in wanted.items() if existing.get(key) != row]
+    deletes = [key for key in existing if key not in wanted]
+    with table.batch_writer() as batch:
+        for row in puts:
+            batch.put_item(Item=row)
+        for (stage, tag) in deletes:
+            batch.delete_item(Key={'stage': stage, 'tag': tag})
+    return len(puts), len(deletes)
+
+
+class DocTemplateCache:
+    '''Template ids of every stage, loaded with one scan. The version item is
+       read at most once per ttl seconds, and the table is scanned again only
+       when that version has moved'''
+
+    def __init__(self, table_name=GDRIVE_DOC_TEMPLATES_TABLE, ttl=DOC_TEMPLATES_VERSION_TTL, clock=time.monotonic):
+        self.table = DDB.Table(table_name)
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None
+        self.templates = None
+        self._checked_at = None
+
+    def get(self, stage):
+        '''Return {tag: id} for the templates of stage'''
+        now = self.clock()
+        if self.templates is None or now - self._checked_at >= self.ttl:
+            version = self._version()
+            if self.templates is None or version != self.version:
+                # Read the version first, a bump during the scan just means
+                # one more reload next time
+                self.templates = self._load()
+                self.version = version
+            self._checked_at = now
+        return dict(self.templates.get(stage, {}))
+
+    def _version(self):
+        item = self.table.get_item(
+            Key=VERSION_KEY,
+            ProjectionExpression='#version',
+            ExpressionAttributeNames={'#version': 'version'}
+        ).get('Item')
+        return item['version'] if item else None
+
+    def _load(self):
+        templates = {}
+        for item in scan_templates(
+                self.table,
+                ProjectionExpression='#stage, #tag, #id',
+                ExpressionAttributeNames={'#stage': 'stage', '#tag': 'tag', '#id': 'id'}):
+            templates.setdefault(item['stage'], {})[item['tag']] = item['id']
+        return templates
@@ -0,0 +1,121 @@
+'''Process-wide authorized Drive client, reused across warm invocations.
+
+   pydrive and the googleapiclient discovery machinery are only imported
+   when the pydrive backend authorizes, so the rest backend never loads them'''
+
+from os import environ as env
+import datetime
+import threading
+
+import httplib2
+import yaml
+from oauth2client.client import AccessTokenRefreshError
+from oauth2client.service_account import ServiceAccountCredentials
+from pydrive.settings import InvalidConfigError
+
+from drive_rest import RestDrive
+
+# pydrive, or rest for the thin Drive v3 client in drive_rest
+DRIVE_BACKEND = env.get('DRIVE_BACKEND', 'pydrive')
+DRIVE_TOKEN_REFRESH_WINDOW = int(env.get('DRIVE_TOKEN_REFRESH_WINDOW', '300'))
+DRIVE_HTTP_TIMEOUT = int(env.get('DRIVE_HTTP_TIMEOUT', '30'))
+# GoogleAuth.DEFAULT_SETTINGS['oauth_scope'], without importing pydrive.auth
+DEFAULT_OAUTH_SCOPE = ['https://www.googleapis.com/auth/drive']
+
+
+class AuthError(Exception):
+    '''Drive authorization failed. Raised in place of pydrive.auth.AuthError
+       so handlers can catch it without importing pydrive.auth'''
+
+
+class RefreshError(AuthError):
+    '''The access token could not be refreshed'''
+
+
+def load_credentials(settings_file):
+    '''Service account credentials from a pydrive settings file, built the
+       way GoogleAuth.ServiceAuth builds them'''
+    try:
+        # pydrive's LoadSettingsFile leaves the file open
+        with open(settings_file, encoding='utf-8') as stream:
+            settings = yaml.safe_load(stream) or {}
+    except (OSError, yaml.YAMLError) as error:
+        raise InvalidConfigError(error) from error
+    config = settings.get('service_config') or {}
+    if 'client_service_email' not in config or 'client_pkcs12_file_path' not in config:
+        raise InvalidConfigError('No service_config in {}'.format(settings_file))
+
+    credentials = ServiceAccountCredentials.from_p12_keyfile(
+        service_account_email=config['client_service_email'],
+        filename=config['client_pkcs12_file_path'],
+        scopes=' '.join(settings.get('oauth_scope', DEFAULT_OAUTH_SCOPE))
+    )
+    if config.get('client_user_email'):
+        credentials = credentials.create_delegated(sub=config['client_user_email'])
+    return credentials
+
+
+def authorize(settings_file):
+    '''Return a GoogleDrive for the service account in settings_file, its
+       service built from the discovery document bundled with
+       googleapiclient, so no discovery request goes over the network'''
+    from googleapiclient.discovery import build
+    from pydrive.auth import GoogleAuth
+    from pydrive.drive import GoogleDrive
+
+    gauth = GoogleAuth(settings_file=settings_file, http_timeout=DRIVE_HTTP_TIMEOUT)
+    gauth.credentials = load_credentials(settings_file)
+    gauth.auth_method = 'service'
+    gauth.http = gauth.credentials.authorize(httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT))
+    gauth.service = build('drive', 'v2', http=gauth.http, cache_discovery=False, static_discovery=True)
+    return GoogleDrive(gauth)
+
+
+def authorize_rest(settings_file):
+    '''Load the same service account as authorize() and return a RestDrive'''
+    return RestDrive(load_credentials(settings_file), timeout=DRIVE_HTTP_TIMEOUT)
+
+
+def load_client(settings_file):
+    '''Authorize a client for the configured DRIVE_BACKEND'''
+    if DRIVE_BACKEND == 'rest':
+        return authorize_rest(settings_file)
+    return authorize(settings_file)
+
+
+class DriveClientFactory:
+    '''Keeps one GoogleDrive per settings file for the life of the container.
+
+       The access token is refreshed refresh_window seconds before it
+       expires. Left to pydrive, an expired service account token rebuilds
+       the whole client on the next call'''
+
+    def __init__(self, refresh_window=DRIVE_TOKEN_REFRESH_WINDOW, loader=load_client, clock=datetime.datetime.utcnow):
+        self.refresh_window = datetime.timedelta(seconds=refresh_window)
+        self.loader = loader
+        self.clock = clock
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, settings_file='settings.yaml'):
+        '''Return the authorized GoogleDrive for settings_file'''
+        with self._lock:
+            drive = self._clients.get(settings_file)
+            if drive is None:
+                drive = self.loader(settings_file)
+                self._clients[settings_file] = drive
+            credentials = drive.auth.credentials
+            if credentials.token_expiry is None or credentials.token_expiry - self.clock() < self.refresh_window:
+                try:
+                    credentials.refresh(httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT))
+                except AccessTokenRefreshError as error:
+                    raise RefreshError('Access token refresh failed: {}'.format(error)) from error
+            return drive
+
+    def invalidate(self, settings_file='settings.yaml'):
+        '''Forget a client so the next get() authorizes from scratch'''
+        with self._lock:
+            self._clients.pop(settings_file, None)
+
+
+DRIVE_CLIENTS = DriveClientFactory()
@@ -0,0 +1,49 @@
+'''Send many Drive API requests in as few HTTP round trips as possible'''
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+# Drive rejects batches of more than 100 calls
+BATCH_SIZE = 100
+
+
+class DriveBatchError(Exception):
+    '''One or more calls in a Drive batch failed'''
+
+    def __init__(self, errors):
+        super().__init__('{} Drive batch call(s) failed: {}'.format(len(errors), list(errors.values())))
+        self.errors = errors
+
+
+def insert_folder_request(drive, parent_folder_id, folder_name):
+    '''Build, without sending, a files.insert request for a new folder'''
+    return drive.auth.service.files().insert(
+        body={
+            'title': folder_name,
+            'parents': [{'id': parent_folder_id}],
+            'mimeType': FOLDER_MIME_TYPE
+        },
+        fields='id,alternateLink'
+    )
+
+
+def execute_batch(drive, requests, http=None):
+    '''Send requests in Drive batches of BATCH_SIZE and return their
+       responses in the same order. Raises DriveBatchError, keyed by
+       request index, once every batch has run if any call failed'''
+    responses = [None] * len(requests)
+    errors = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors[int(request_id)] = exception
+        else:
+            responses[int(request_id)] = response
+
+    for start in range(0, len(requests), BATCH_SIZE):
+        batch = drive.auth.service.new_batch_http_request(callback=callback)
+        for (index, request) in enumerate(requests[start:start + BATCH_SIZE], start):
+            batch.add(request, request_id=str(index))
+        batch.execute(http=http)
+
+    if errors:
+        raise DriveBatchError(errors)
+    return responses
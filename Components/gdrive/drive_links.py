@@ -0,0 +1,41 @@
+'''Cache of Drive alternateLinks keyed by file id'''
+
+from os import environ as env
+from collections import OrderedDict
+import threading
+
+DRIVE_LINK_CACHE_SIZE = int(env.get('DRIVE_LINK_CACHE_SIZE', '1024'))
+
+
+class LinkCache:
+    '''alternateLinks never change for a file id, so every create, copy and
+       list response that carries one is remembered here and a separate
+       files.get is only made for an id no response has mentioned'''
+
+    def __init__(self, max_entries=DRIVE_LINK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._links = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, item):
+        '''Store the alternateLink of a Drive resource dict, if it has one'''
+        link = item.get('alternateLink')
+        if link is None:
+            return
+        with self._lock:
+            self._links[item['id']] = link
+            self._links.move_to_end(item['id'])
+            while len(self._links) > self.max_entries:
+                self._links.popitem(last=False)
+
+    def get(self, drive, file_id, http=None):
+        '''Return the alternateLink of file_id, fetching only the link on a miss'''
+        link = self._links.get(file_id)
+        if link is None:
+            item = drive.auth.service.files().get(fileId=file_id, fields='id,alternateLink').execute(http=http)
+            self.remember(item)
+            link = item['alternateLink']
+        return link
+
+
+LINKS = LinkCache()
@@ -0,0 +1,115 @@
+'''Run independent Drive calls side by side on a bounded thread pool'''
+
+from os import environ as env
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import threading
+import time
+import weakref
+
+DRIVE_MAX_WORKERS = int(env.get('DRIVE_MAX_WORKERS', '4'))
+DRIVE_CALL_TIMEOUT = float(env.get('DRIVE_CALL_TIMEOUT', '30'))
+
+
+class DriveCallTimeout(Exception):
+    '''A Drive call did not finish before its deadline'''
+
+
+class DrivePool:
+    '''Maps a function over items with at most max_workers Drive calls in
+       flight. Each call has timeout seconds from when a worker picks it up.
+
+       httplib2 connections are not thread-safe, so the function is called
+       as func(item, http) with an authorized Http no other call is using,
+       and must execute every Drive request with it. pydrive calls such as
+       ListFile().GetList() share one Http and must not be mapped.
+
+       Finished calls hand their Http back to the pool, so a pool kept for
+       the life of the container, see DRIVE_POOLS, reuses the connections
+       across invocations'''
+
+    def __init__(self, drive, max_workers=DRIVE_MAX_WORKERS, timeout=DRIVE_CALL_TIMEOUT, clock=time.monotonic):
+        self.drive = drive
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.clock = clock
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def http(self):
+        '''Check out an idle authorized Http, or a new one if none is idle.
+           Hand it back with release() once done'''
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.drive.auth.Get_Http_Object()
+
+    def release(self, http):
+        '''Return an Http from http() to the pool'''
+        with self._lock:
+            self._idle.append(http)
+
+    def call(self, func, item):
+        '''func(item, http) with an Http of the pool'''
+        http = self.http()
+        try:
+            return func(item, http)
+        finally:
+            self.release(http)
+
+    def map(self, func, items):
+        '''Return [func(item, http) for item in items], run in parallel. If any
+           call fails, the exception of the first failed item is raised unchanged'''
+        items = list(items)
+        if len(items) < 2 or self.max_workers < 2:
+            return [self.call(func, item) for item in items]
+
+        started = [None] * len(items)
+
+        def run(index, item):
+            started[index] = self.clock()
+            return self.call(func, item)
+
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(items)))
+        futures = [executor.submit(run, index, item) for (index, item) in enumerate(items)]
+        try:
+            return [self._result(future, started, index) for (index, future) in enumerate(futures)]
+        finally:
+            for future in futures:
+                future.cancel()
+            # Never block the invocation on a call that has already timed out
+            executor.shutdown(wait=False)
+
+    def _result(self, future, started, index):
+        while True:
+            if started[index] is None:
+                wait = self.timeout
+            else:
+                wait = max(0, started[index] + self.timeout - self.clock())
+            try:
+                return future.result(timeout=wait)
+            except FutureTimeoutError:
+                # Still queued behind other calls, its deadline has not started
+                if started[index] is not None and self.clock() - started[index] >= self.timeout:
+                    raise DriveCallTimeout('Drive call {} took longer than {}s'.format(index, self.timeout))
+
+
+class DrivePools:
+    '''One DrivePool per Drive client, kept while the client is, so warm
+       invocations reuse the pool's Http objects and their connections'''
+
+    def __init__(self, **options):
+        self.options = options
+        self._pools = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, drive):
+        '''Return the DrivePool for drive'''
+        with self._lock:
+            pool = self._pools.get(drive)
+            if pool is None:
+                pool = DrivePool(drive, **self.options)
+                self._pools[drive] = pool
+            return pool
+
+
+DRIVE_POOLS = DrivePools()
@@ -0,0 +1,170 @@
+'''Drive listing queries that push filtering to the server'''
+
+import threading
+
+from drive_batch import FOLDER_MIME_TYPE
+from drive_links import LINKS
+
+# Keep each q well under Drive's query length limit
+PARENTS_PER_QUERY = 50
+PAGE_SIZE = 1000
+# Name lookups expect a single match, a handful covers duplicates
+FIND_PAGE_SIZE = 10
+
+
+def escape_query_value(value):
+    '''Escape a string for use inside a quoted Drive q literal'''
+    return value.replace('\\', '\\\\').replace("'", "\\'")
+
+
+def mime_type_clause(directory_only):
+    '''q clause matching folders, or everything but folders, like list_file_object'''
+    if directory_only:
+        return "mimeType = '{}'".format(FOLDER_MIME_TYPE)
+    return "mimeType != '{}'".format(FOLDER_MIME_TYPE)
+
+
+def iter_items(drive, folder_id, fields, directory_only=None, page_size=PAGE_SIZE, http=None):
+    '''Yield the listing item, projected to fields, for each child of
+       folder_id, one page at a time. Links in the items are kept in LINKS'''
+    clauses = ["'{}' in parents".format(escape_query_value(folder_id)), 'trashed=false']
+    if directory_only is not None:
+        clauses.append(mime_type_clause(directory_only))
+
+    page_token = None
+    while True:
+        result = drive.auth.service.files().list(
+            q=' and '.join(clauses),
+            maxResults=page_size,
+            pageToken=page_token,
+            fields='nextPageToken,items({})'.format(fields)
+        ).execute(http=http)
+        for item in result.get('items', []):
+            LINKS.remember(item)
+            yield item
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def iter_children(drive, folder_id, directory_only=None, page_size=PAGE_SIZE, http=None):
+    '''Yield (id, title, mimeType) for each child of folder_id, one page at
+       a time, so a caller that stops early never fetches the later pages.
+       directory_only=None yields folders and files alike'''
+    for item in iter_items(drive, folder_id, 'id,title,mimeType,alternateLink', directory_only, page_size, http):
+        yield item['id'], item['title'], item['mimeType']
+
+
+def list_file_object(drive, folder_id, directory_only=False):
+    '''Returns list of the folder's child folders, or of its other files'''
+    return [
+        {'id': file_id, 'title': title}
+        for (file_id, title, _) in iter_children(drive, folder_id, directory_only)
+    ]
+
+
+def list_file_properties(drive, folder_id, directory_only=False, http=None):
+    '''Like list_file_object, with each file's properties read by the same
+       listing: [{'id', 'title', 'properties': [{'key', 'value', 'visibility'}]}]'''
+    return [
+        {'id': item['id'], 'title': item['title'], 'properties': item.get('properties', [])}
+        for item in iter_items(drive, folder_id, 'id,title,properties(key,value,visibility)', directory_only, http=http)
+    ]
+
+
+def list_children(drive, parent_ids, directory_only=False, http=None):
+    '''List the children of several folders with one paged query per
+       PARENTS_PER_QUERY parents. Returns {parent_id: [{'id', 'title'}]}
+       with an entry, possibly empty, for every parent asked for'''
+    parent_ids = list(parent_ids)
+    children = {parent_id: [] for parent_id in parent_ids}
+
+    for start in range(0, len(parent_ids), PARENTS_PER_QUERY):
+        chunk = parent_ids[start:start + PARENTS_PER_QUERY]
+        q = '({}) and {} and trashed=false'.format(
+            ' or '.join("'{}' in parents".format(escape_query_value(parent_id)) for parent_id in chunk),
+            mime_type_clause(directory_only)
+        )
+        page_token = None
+        while True:
+            result = drive.auth.service.files().list(
+                q=q,
+                maxResults=PAGE_SIZE,
+                pageToken=page_token,
+                fields='nextPageToken,items(id,title,alternateLink,parents(id))'
+            ).execute(http=http)
+            for item in result.get('items', []):
+                LINKS.remember(item)
+                for parent in item.get('parents', []):
+                    if parent['id'] in children:
+                        children[parent['id']].append({'id': item['id'], 'title': item['title']})
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                break
+
+    return children
+
+
+def find_children(drive, parent_id, title, directory_only=None, http=None):
+    '''Return [{'id', 'title'}] for the children of parent_id named title.
+       The title, type and parent filters run server side and only the
+       first page is read, so the cost does not grow with the folder.
+       Links of the matches are kept in LINKS.
+       directory_only=None matches folders and files alike'''
+    clauses = [
+        "'{}' in parents".format(escape_query_value(parent_id)),
+        "title = '{}'".format(escape_query_value(title)),
+        'trashed=false'
+    ]
+    if directory_only is not None:
+        clauses.append(mime_type_clause(directory_only))
+
+    result = drive.auth.service.files().list(
+        q=' and '.join(clauses),
+        maxResults=FIND_PAGE_SIZE,
+        fields='items(id,title,alternateLink)'
+    ).execute(http=http)
+    for item in result.get('items', []):
+        LINKS.remember(item)
+    return [{'id': item['id'], 'title': item['title']} for item in result.get('items', [])]
+
+
+class ChildIndex:
+    '''Contents of folders indexed by title for one invocation. Each folder
+       is listed at most once however many threads ask about it, and add()
+       records files created along the way, so later lookups never go back
+       to Drive. directory_only is as for list_file_object'''
+
+    def __init__(self, drive, directory_only=False):
+        self.drive = drive
+        self.directory_only = directory_only
+        self._titles = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, folder_id, title, http=None):
+        '''Return [{'id', 'title'}] for the children of folder_id named title'''
+        return list(self._index(folder_id, http).get(title, []))
+
+    def add(self, folder_id, item):
+        '''Record a {'id', 'title'} child created in folder_id'''
+        with self._lock:
+            titles = self._titles.get(folder_id)
+            if titles is not None:
+                titles.setdefault(item['title'], []).append({'id': item['id'], 'title': item['title']})
+
+    def _index(self, folder_id, http):
+        with self._lock:
+            if folder_id in self._titles:
+                return self._titles[folder_id]
+            folder_lock = self._locks.setdefault(folder_id, threading.Lock())
+        with folder_lock:
+            with self._lock:
+                if folder_id in self._titles:
+                    return self._titles[folder_id]
+            titles = {}
+            for (child_id, title, _) in iter_children(self.drive, folder_id, self.directory_only, http=http):
+                titles.setdefault(title, []).append({'id': child_id, 'title': title})
+            with self._lock:
+                self._titles[folder_id] = titles
+            return titles
@@ -0,0 +1,293 @@
+'''Thin Drive v3 client over a pooled keep-alive session.
+
+   RestDrive can stand in for pydrive's GoogleDrive because the gdrive
+   functions only reach Drive through drive.auth.service. The v2 calls they
+   make (files list/get/insert/copy, properties list/get and batches) are
+   sent as their v3 equivalents and the responses renamed back to v2 fields'''
+
+from os import environ as env
+from email.parser import BytesParser
+from urllib.parse import urlencode
+import json
+import re
+import threading
+import uuid
+
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from googleapiclient.errors import HttpError
+
+DRIVE_API_ROOT = 'https://www.googleapis.com'
+DRIVE_API_PATH = '/drive/v3'
+DRIVE_BATCH_URL = DRIVE_API_ROOT + '/batch/drive/v3'
+DRIVE_POOL_SIZE = int(env.get('DRIVE_POOL_SIZE', '10'))
+
+# v2 names used by the gdrive functions and their v3 equivalents
+V3_NAMES = {
+    'items': 'files',
+    'title': 'name',
+    'alternateLink': 'webViewLink'
+}
+V2_NAMES = {v3: v2 for (v2, v3) in V3_NAMES.items()}
+QUOTED = re.compile(r"('(?:\\.|[^'\\])*')")
+
+
+def v3_fields(fields):
+    '''Rewrite a v2 fields projection for v3'''
+    if fields is None:
+        return None
+    fields = fields.replace('parents(id)', 'parents').replace('labels(trashed)', 'trashed')
+    fields = fields.replace('properties(key,value,visibility)', 'properties,appProperties')
+    return re.sub(r'\b(items|title|alternateLink)\b', lambda m: V3_NAMES[m.group(1)], fields)
+
+
+def v3_query(q):
+    '''Rewrite a v2 search query for v3, leaving quoted literals alone'''
+    parts = QUOTED.split(q)
+    for index in range(0, len(parts), 2):
+        parts[index] = re.sub(r'\btitle\b', 'name', parts[index])
+    return ''.join(parts)
+
+
+def v3_body(body):
+    '''Rewrite a v2 file resource for an insert or copy'''
+    body = dict(body)
+    if 'title' in body:
+        body['name'] = body.pop('title')
+    if 'parents' in body:
+        body['parents'] = [parent['id'] for parent in body['parents']]
+    return body
+
+
+def v2_properties(resource):
+    '''v2 property list of a v3 file, public properties then private ones'''
+    return [
+        {'key': key, 'value': value, 'visibility': visibility}
+        for (field, visibility) in (('properties', 'PUBLIC'), ('appProperties', 'PRIVATE'))
+        for (key, value) in resource.get(field, {}).items()
+    ]
+
+
+def to_v2(resource):
+    '''Rename a v3 file or file list response to the v2 names callers read'''
+    if 'properties' in resource or 'appProperties' in resource:
+        resource = dict(resource, properties=v2_properties(resource))
+        resource.pop('appProperties', None)
+    resource = {V2_NAMES.get(key, key): value for (key, value) in resource.items()}
+    if 'items' in resource:
+        resource['items'] = [to_v2(item) for item in resource['items']]
+    if 'parents' in resource:
+        resource['parents'] = [{'id': parent} for parent in resource['parents']]
+    if 'trashed' in resource:
+        resource['labels'] = {'trashed': resource.pop('trashed')}
+    return resource
+
+
+def http_error(status, content, uri):
+    '''The googleapiclient error callers already catch, e.g. for a 404'''
+    return HttpError(httplib2.Response({'status': status}), content, uri=uri)
+
+
+def new_session(pool_size=DRIVE_POOL_SIZE):
+    '''Session keeping up to pool_size connections to Drive alive'''
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    return session
+
+
+class RestRequest:
+    '''One Drive v3 call, sent by execute() or added to a batch'''
+
+    def __init__(self, drive, method, path, params=None, body=None, convert=to_v2):
+        self.drive = drive
+        self.method = method
+        self.path = DRIVE_API_PATH + path
+        self.params = {key: value for (key, value) in (params or {}).items() if value is not None}
+        self.body = body
+        self.convert = convert
+
+    @property
+    def uri(self):
+        '''Path and query string, as written in a batch part'''
+        if not self.params:
+            return self.path
+        return '{}?{}'.format(self.path, urlencode(self.params))
+
+    def execute(self, http=None):
+        '''Send the request. http exists for googleapiclient compatibility and
+           is ignored, the session's pool is safe to share between threads'''
+        response = self.drive.send(self.method, DRIVE_API_ROOT + self.path, params=self.params, json=self.body)
+        return self.convert(response.json())
+
+
+class RestBatch:
+    '''multipart/mixed batch with googleapiclient's add/execute interface'''
+
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        '''Queue request, numbering it when no request_id is given'''
+        if request_id is None:
+            request_id = str(len(self.requests))
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        '''Send every request in one round trip and call callback(request_id,
+           response, exception) for each of them in the order they were added'''
+        if not self.requests:
+            return
+        boundary = uuid.uuid4().hex
+        parts = []
+        for (index, (_, request)) in enumerate(self.requests):
+            lines = [
+                '--' + boundary,
+                'Content-Type: application/http',
+                'Content-ID: <{}+{}>'.format(boundary, index),
+                '',
+                '{} {} HTTP/1.1'.format(request.method, request.uri)
+            ]
+            if request.body is not None:
+                lines += ['Content-Type: application/json; charset=UTF-8', '', json.dumps(request.body)]
+            else:
+                lines += ['', '']
+            parts.append('\r\n'.join(lines))
+        payload = '\r\n'.join(parts) + '\r\n--{}--\r\n'.format(boundary)
+
+        response = self.drive.send(
+            'POST',
+            DRIVE_BATCH_URL,
+            data=payload.encode('utf-8'),
+            headers={'Content-Type': 'multipart/mixed; boundary=' + boundary}
+        )
+        results = parse_batch_response(response.headers['Content-Type'], response.content)
+
+        for (index, (request_id, request)) in enumerate(self.requests):
+            (status, content) = results.get(str(index), (500, b'missing from batch response'))
+            if status >= 400:
+                self.callback(request_id, None, http_error(status, content, request.uri))
+                continue
+            try:
+                result = request.convert(json.loads(content.decode('utf-8')) if content else {})
+            except HttpError as error:
+                self.callback(request_id, None, error)
+            else:
+                self.callback(request_id, result, None)
+
+
+def parse_batch_response(content_type, content):
+    '''Return {index: (status, body bytes)} from a multipart/mixed response'''
+    message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('utf-8') + b'\r\n\r\n' + content)
+    results = {}
+    for part in message.get_payload():
+        # Content-ID: <response-{boundary}+{index}>
+        index = part['Content-ID'].strip('<>').rsplit('+', 1)[-1]
+        http_response = part.get_payload(decode=True)
+        (status_line, _, rest) = http_response.partition(b'\n')
+        body = re.split(rb'\r?\n\r?\n', rest, 1)
+        results[index] = (int(status_line.split()[1]), body[1].strip() if len(body) > 1 else b'')
+    return results
+
+
+class RestFiles:
+    '''files() resource, in v2 terms'''
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q=None, maxResults=None, pageToken=None, fields=None):
+        '''One page of files matching the v2 query q'''
+        return RestRequest(self.drive, 'GET', '/files', {
+            'q': v3_query(q) if q else None,
+            'pageSize': maxResults,
+            'pageToken': pageToken,
+            'fields': v3_fields(fields)
+        })
+
+    def get(self, fileId, fields=None):
+        '''A single file's metadata'''
+        return RestRequest(self.drive, 'GET', '/files/{}'.format(fileId), {'fields': v3_fields(fields)})
+
+    def insert(self, body, fields=None):
+        '''Create a file, or a folder, from a v2 resource body'''
+        return RestRequest(self.drive, 'POST', '/files', {'fields': v3_fields(fields)}, v3_body(body))
+
+    def copy(self, fileId, body, fields=None):
+        '''Copy a file, naming and placing the copy from a v2 resource body'''
+        return RestRequest(self.drive, 'POST', '/files/{}/copy'.format(fileId), {'fields': v3_fields(fields)}, v3_body(body))
+
+
+class RestProperties:
+    '''properties() resource, in v2 terms. v3 keeps public properties in
+       properties and private ones in appProperties on the file itself'''
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, fileId):
+        '''Every public and private property of a file'''
+        return RestRequest(self.drive, 'GET', '/files/{}'.format(fileId), {'fields': 'properties,appProperties'},
+                           convert=lambda resource: {'items': v2_properties(resource)})
+
+    def get(self, fileId, propertyKey, visibility='private'):
+        '''One property of a file, raising HttpError 404 when it is not set'''
+        field = 'properties' if visibility.lower() == 'public' else 'appProperties'
+        path = '/files/{}'.format(fileId)
+
+        def convert(resource):
+            value = resource.get(field, {}).get(propertyKey)
+            if value is None:
+                raise http_error(404, b'Property not found', DRIVE_API_PATH + path)
+            return {'key': propertyKey, 'value': value, 'visibility': visibility.upper()}
+        return RestRequest(self.drive, 'GET', path, {'fields': field}, convert=convert)
+
+
+class RestDrive:
+    '''Drive v3 over a requests session, answering to drive.auth.service and
+       drive.auth.credentials like pydrive's GoogleDrive'''
+
+    def __init__(self, credentials, timeout=None, session=None):
+        self.credentials = credentials
+        self.timeout = timeout
+        self.session = session if session is not None else new_session()
+        self.auth = self
+        self.service = self
+        self._lock = threading.Lock()
+
+    def files(self):
+        '''The files() resource'''
+        return RestFiles(self)
+
+    def properties(self):
+        '''The properties() resource'''
+        return RestProperties(self)
+
+    def new_batch_http_request(self, callback=None):
+        '''An empty batch calling callback for each response'''
+        return RestBatch(self, callback)
+
+    def Get_Http_Object(self):
+        '''Nothing to hand out per thread, the session is shared'''
+        return None
+
+    def access_token(self, refresh=False):
+        '''Return a bearer token, refreshing it first when asked or expired'''
+        with self._lock:
+            if refresh or self.credentials.access_token is None or self.credentials.access_token_expired:
+                self.credentials.refresh(httplib2.Http(timeout=self.timeout))
+            return self.credentials.access_token
+
+    def send(self, method, url, headers=None, **kwargs):
+        '''Make an authorized request, retrying once with a new token on a 401.
+           Raises HttpError for any other error status'''
+        for refresh in (False, True):
+            request_headers = dict(headers or {}, Authorization='Bearer ' + self.access_token(refresh))
+            response = self.session.request(method, url, headers=request_headers, timeout=self.timeout, **kwargs)
+            if response.status_code != 401:
+                break
+        if response.status_code >= 400:
+            raise http_error(response.status_code, response.content, url)
+        return response
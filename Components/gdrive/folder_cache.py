@@ -0,0 +1,101 @@
+'''Read-through cache of customer/project folder ids kept in gdrive-customers'''
+
+from os import environ as env
+from collections import OrderedDict
+import logging
+
+import boto3
+from botocore.exceptions import ClientError
+
+from drive_batch import DriveBatchError, execute_batch
+from drive_links import LINKS
+
+LOGGER = logging.getLogger()
+
+GDRIVE_CUSTOMERS_TABLE = env.get('GDRIVE_CUSTOMERS_TABLE', 'gdrive-customers')
+FOLDER_CACHE_SIZE = int(env.get('FOLDER_CACHE_SIZE', '128'))
+DDB = boto3.resource('dynamodb', region_name='us-east-1')
+
+
+def folder_id_values(folder_ids):
+    '''Every folder id in a folder_ids map, however deeply nested'''
+    for value in folder_ids.values():
+        if isinstance(value, dict):
+            yield from folder_id_values(value)
+        else:
+            yield value
+
+
+class FolderIdCache:
+    '''Finds the folder_ids of a customer project without walking Drive.
+       Looks in an in-process LRU, then gdrive-customers, and trusts what
+       it finds only once one batched files.get shows every folder still
+       exists outside the trash. Any miss means the caller rediscovers'''
+
+    def __init__(self, table_name=GDRIVE_CUSTOMERS_TABLE, max_entries=FOLDER_CACHE_SIZE):
+        self.table = DDB.Table(table_name)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def resolve(self, drive, customer, project):
+        '''Return (folder_ids, links) with links mapping each folder id to its
+           alternateLink, or None when the ids are unknown or stale'''
+        key = (customer, project)
+        folder_ids = self._entries.get(key)
+        if folder_ids is None:
+            folder_ids = self._load(customer, project)
+        if folder_ids is None:
+            return None
+
+        links = self._validate(drive, folder_ids)
+        if links is None:
+            self.forget(customer, project)
+            return None
+
+        self.remember(customer, project, folder_ids)
+        return folder_ids, links
+
+    def remember(self, customer, project, folder_ids):
+        '''Keep folder_ids for this container, evicting the least recently used'''
+        key = (customer, project)
+        self._entries[key] = folder_ids
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, customer, project):
+        '''Drop a project from the in-process cache'''
+        self._entries.pop((customer, project), None)
+
+    def _load(self, customer, project):
+        try:
+            response = self.table.get_item(
+                Key={
+                    'customer': customer,
+                    'project': project
+                },
+                ProjectionExpression='folder_ids'
+            )
+        except ClientError as error:
+            # Fall back to Drive discovery rather than fail the event
+            LOGGER.exception(error)
+            return None
+        return response.get('Item', {}).get('folder_ids')
+
+    def _validate(self, drive, folder_ids):
+        folder_ids_list = list(folder_id_values(folder_ids))
+        try:
+            files = execute_batch(drive, [
+                drive.auth.service.files().get(fileId=folder_id, fields='id,alternateLink,labels(trashed)')
+                for folder_id in folder_ids_list
+            ])
+        except DriveBatchError as error:
+            # Usually a 404 for a folder deleted outside of this automation
+            LOGGER.warning('Stored folder ids failed validation: %s', error)
+            return None
+
+        if any(f.get('labels', {}).get('trashed') for f in files):
+            return None
+        for f in files:
+            LINKS.remember(f)
+        return {f['id']: f.get('alternateLink') for f in files}
@@ -0,0 +1,117 @@
+'''Declarative folder layout for a customer, diffed against Drive and
+   created one batch per depth'''
+
+import math
+
+from drive_batch import BATCH_SIZE, execute_batch, insert_folder_request
+from drive_links import LINKS
+from drive_query import list_children
+
+PROJECT_FOLDER = 'Project Name: {project}'
+
+# Folders under a customer's root folder; titles are formatted with the project name
+CUSTOMER_LAYOUT = {
+    '_SALES': {
+        PROJECT_FOLDER: {
+            'APN Portal Admin': {},
+            'Deliverables': {},
+            'Meeting_Notes': {},
+            'SOW': {}
+        }
+    },
+    '_ENGINEERING': {
+        PROJECT_FOLDER: {
+            'Deliverables': {},
+            'Provided_Documents': {}
+        }
+    },
+    '_DELIVERY': {
+        PROJECT_FOLDER: {
+            'Weekly_Action_Reports': {},
+            'Engagement_Data_Reports': {},
+            'Communications': {},
+            'Onboarding': {},
+            'Who’s Who': {}
+        }
+    },
+    '_ACCOUNT': {}
+}
+
+
+def render_layout(layout, **names):
+    '''Fill the placeholders in every folder title of layout'''
+    return {title.format(**names): render_layout(children, **names) for (title, children) in layout.items()}
+
+
+class FolderPlan:
+    '''What it takes to make Drive match a layout. Folders are addressed by
+       their path of titles below the root; existing maps paths already in
+       Drive to their ids and levels lists the missing paths by depth'''
+
+    def __init__(self, existing, levels):
+        self.existing = existing
+        self.levels = levels
+
+    @property
+    def creates(self):
+        '''Number of folders to create'''
+        return sum(len(level) for level in self.levels)
+
+    @property
+    def calls(self):
+        '''Number of Drive batch calls apply_plan will make'''
+        return sum(math.ceil(len(level) / BATCH_SIZE) for level in self.levels)
+
+    def describe(self):
+        '''One line summary, for a dry run or the log'''
+        return '{} folder(s) to create in {} batch call(s): {}'.format(
+            self.creates,
+            self.calls,
+            ['/'.join(path) for level in self.levels for path in level]
+        )
+
+
+def plan_layout(drive, root_id, layout, root_empty=False):
+    '''Compare layout with the folders under root_id and return a FolderPlan.
+       Discovery costs one listing query per depth, and nothing below a
+       folder that does not exist yet. With root_empty, for instance for a
+       folder just created, nothing is listed at all'''
+    existing = {(): root_id}
+    levels = []
+    level = [((), layout)]
+    while level:
+        # Below an empty root no folder exists, so there is never anything to list
+        parents = [] if root_empty else [path for (path, children) in level if children and path in existing]
+        listed = list_children(drive, [existing[path] for path in parents], directory_only=True) if parents else {}
+
+        missing = []
+        next_level = []
+        for (path, children) in level:
+            found = {}
+            for child in listed.get(existing.get(path), []):
+                found.setdefault(child['title'], child['id'])
+            for (title, grandchildren) in children.items():
+                child_path = path + (title,)
+                if title in found:
+                    existing[child_path] = found[title]
+                else:
+                    missing.append(child_path)
+                next_level.append((child_path, grandchildren))
+
+        if missing:
+            levels.append(missing)
+        level = next_level
+
+    return FolderPlan(existing, levels)
+
+
+def apply_plan(drive, plan):
+    '''Create the missing folders, one batch per depth, and return the ids
+       of every folder in the layout keyed by path'''
+    folder_ids = dict(plan.existing)
+    for level in plan.levels:
+        created = execute_batch(drive, [insert_folder_request(drive, folder_ids[path[:-1]], path[-1]) for path in level])
+        for folder in created:
+            LINKS.remember(folder)
+        folder_ids.update(zip(level, [folder['id'] for folder in created]))
+    return folder_ids
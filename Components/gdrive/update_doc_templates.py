@@ -1,7 +1,6 @@
 '''Retrieves information about Doc Templates from Gdrive and updates dynamodb'''
 
 from os import environ as env
-from operator import eq, ne
 import logging
 import json
 import sys
@@ -10,10 +9,10 @@ import boto3
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 from googleapiclient.errors import HttpError
-from pydrive.auth import GoogleAuth, AuthError
-from pydrive.drive import GoogleDrive
-from pydrive.files import ApiRequestError, FileNotUploadedError
 from pydrive.settings import InvalidConfigError
+from doc_templates import bump_version, sync_templates
+from drive_auth import DRIVE_CLIENTS, AuthError
+from drive_query import list_file_properties
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.WARNING)
@@ -45,12 +44,9 @@ class GDriveBaseError(Exception):
 
 
 def init_auth(settings_file='settings.yaml'):
-    '''Initialize GoogleDrive auth object'''
+    '''Return the GoogleDrive client, authorized once per container'''
     try:
-        gauth = GoogleAuth(
-            settings_file=settings_file
-        )
-        gauth.ServiceAuth()
+        drive = DRIVE_CLIENTS.get(settings_file)
     except AuthError as erra:
         exc_info = sys.exc_info()
         raise GDriveAuthError(erra).with_traceback(exc_info[2])
@@ -58,7 +54,7 @@ def init_auth(settings_file='settings.yaml'):
         exc_info = sys.exc_info()
         raise GDriveBaseError(errc).with_traceback(exc_info[2])
 
-    return GoogleDrive(gauth)
+    return drive
 
 
 def build_sns_message():
@@ -106,37 +102,18 @@ def publish_sns_message(sns_topic_arn, message, attributes):
     return resp
 
 
-def list_file_object(drive, folder_id, directory_only=False):
-    '''Iterates over a folder and returns list of all child objects'''
-    _q = {'q': "'{}' in parents and trashed=false".format(folder_id)}
-    file_object_list = drive.ListFile(_q).GetList()
-    op = {True: eq, False: ne}[directory_only]
-    file_objects = [
-        x for x in file_object_list
-        if op(x['mimeType'], 'application/vnd.google-apps.folder')
-    ]
-    return [{'id': fld['id'], 'title': fld['title']} for fld in file_objects]
-
-
-def get_properties(drive, file_id):
-    '''Retrieves "stage" and "tag" GdriveFile properties'''
+def get_properties(doc):
+    '''Retrieves "stage" and "tag" GdriveFile properties from a listing item.
+       A private property wins over a public one with the same key, as with
+       properties().get'''
     prop = {
         'stage': 'none',
         'tag': 'untagged'
     }
-    props = drive.auth.service.properties().list(fileId=file_id).execute()
-    if props['items']:
-        for prop in props['items']:
-            try:
-                tag_prop = drive.auth.service.properties().get(fileId=file_id, propertyKey='tag').execute()
-                prop['tag'] = tag_prop['value']
-            except HttpError as errh:
-                pass
-            try:
-                stage_prop = drive.auth.service.properties().get(fileId=file_id, propertyKey='stage').execute()
-                prop['stage'] = stage_prop['value']
-            except HttpError as errh:
-                pass
+    for visibility in ('PUBLIC', 'PRIVATE'):
+        for item in doc.get('properties', []):
+            if item['key'] in prop and item.get('visibility', 'PRIVATE').upper() == visibility:
+                prop[item['key']] = item['value']
 
     return prop
 
@@ -155,25 +132,28 @@ def lambda_handler(event, context):
 
     print('Event received: {}'.format(event))
 
-    table = DDB.Table('gdrive-doc-templates')
-
     drive = init_auth()
-    doc_list = list_file_object(drive, GDRIVE_DOC_TEMPLATE_FOLDER_ID)
+    # Properties come with the listing, no call per template
+    doc_list = list_file_properties(drive, GDRIVE_DOC_TEMPLATE_FOLDER_ID)
 
     try:
-        for doc in doc_list:
-            # Retrieve stage and tag properties if they are present
-            prop = get_properties(drive, doc['id'])
-
-            # Update gdrive-doc-templates table
-            table.put_item(
-                Item={
-                    'stage': prop['stage'],
-                    'tag': prop['tag'],
-                    'title': doc['title'],
-                    'id': doc['id']
-                }
-            )
+        # Retrieve stage and tag properties if they are present
+        props = [get_properties(doc) for doc in doc_list]
+
+        # Update gdrive-doc-templates table with only what changed
+        (puts, deletes) = sync_templates([
+            {
+                'stage': prop['stage'],
+                'tag': prop['tag'],
+                'title': doc['title'],
+                'id': doc['id']
+            }
+            for (doc, prop) in zip(doc_list, props)
+        ])
+        print('Templates written: {}, removed: {}'.format(puts, deletes))
+        if puts or deletes:
+            # Make the copy functions reload their cached template ids
+            bump_version()
 
         # Publish a message to Gdrive Topic
         sns_message = build_sns_message()
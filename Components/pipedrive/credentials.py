@@ -0,0 +1,100 @@
+'''Process-wide cache for the Pipedrive API token and company domain'''
+
+from os import environ as env
+import logging
+import threading
+import time
+
+import boto3
+
+from pipedrive_client import CLIENT
+
+LOGGER = logging.getLogger()
+
+API_TOKEN_PATH = env.get('API_TOKEN_PATH')
+CREDENTIALS_TTL = int(env.get('CREDENTIALS_TTL', '900'))
+CREDENTIALS_REFRESH_WINDOW = int(env.get('CREDENTIALS_REFRESH_WINDOW', '120'))
+
+
+def fetch_api_token(credential_path):
+    ''' Fetch and return the PipeDrive API token '''
+    ssm = boto3.client('ssm')
+    parameter = ssm.get_parameter(Name=credential_path, WithDecryption=True)
+    return parameter['Parameter']['Value']
+
+
+def get_company_domain(api_token):
+    '''Pipedrive call using the api token to return the company domain'''
+    url = 'https://api.pipedrive.com/v1/users/me?api_token=' + api_token
+
+    resp = CLIENT.get(url)
+    return resp.json()['data']['company_domain']
+
+
+def load_credentials(credential_path):
+    '''Fetch the token from SSM and look up its company domain'''
+    token = fetch_api_token(credential_path)
+    domain = get_company_domain(token)
+    return token, domain
+
+
+class CredentialProvider:
+    '''Caches (token, domain) between warm invocations.
+
+       Once the cached pair is inside the refresh window the next get()
+       reloads it before returning. Lambda freezes the process between
+       invocations, so the reload is not left to a background thread. If it
+       fails the current pair is served until it expires.'''
+
+    def __init__(self, credential_path, ttl=CREDENTIALS_TTL, refresh_window=CREDENTIALS_REFRESH_WINDOW,
+                 loader=load_credentials, clock=time.monotonic):
+        self.credential_path = credential_path
+        self.ttl = ttl
+        self.refresh_window = refresh_window
+        self.loader = loader
+        self.clock = clock
+        self._credentials = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        '''Return (token, domain), loading them if the cache is empty or expired'''
+        with self._lock:
+            now = self.clock()
+            if self._credentials is None or now >= self._expires_at:
+                self._store(self.loader(self.credential_path))
+            elif now >= self._expires_at - self.refresh_window:
+                self._refresh()
+            return self._credentials
+
+    def invalidate(self):
+        '''Forget the cached credentials so the next get() reloads them'''
+        with self._lock:
+            self._credentials = None
+            self._expires_at = 0
+
+    def invalidate_if_unauthorized(self, error):
+        '''Invalidate when Pipedrive rejected the cached token with a 401.
+           error may be the requests exception or one raised from it'''
+        response = getattr(error, 'response', None)
+        if response is None:
+            response = getattr(error.__cause__, 'response', None)
+        if response is not None and response.status_code == 401:
+            LOGGER.warning('Pipedrive returned 401, dropping cached credentials')
+            self.invalidate()
+
+    def _refresh(self):
+        try:
+            credentials = self.loader(self.credential_path)
+        except Exception as error:
+            # Keep serving the current pair; get() must reload it at expiry
+            LOGGER.exception(error)
+            return
+        self._store(credentials)
+
+    def _store(self, credentials):
+        self._credentials = credentials
+        self._expires_at = self.clock() + self.ttl
+
+
+CREDENTIALS = CredentialProvider(API_TOKEN_PATH)
@@ -0,0 +1,122 @@
+'''Warm-container cache for the Pipedrive dealFields schema'''
+
+from os import environ as env
+import time
+
+from pipedrive_client import CLIENT
+
+DEAL_FIELDS_TTL = int(env.get('DEAL_FIELDS_TTL', '300'))
+# A schema fetched more recently than this is not refetched for a missing field
+DEAL_FIELDS_MIN_AGE = int(env.get('DEAL_FIELDS_MIN_AGE', '60'))
+
+
+def fetch_deal_fields(domain, token):
+    '''Retrieve all Deal Fields (key, name and options) from Pipedrive'''
+    url = 'https://{}.pipedrive.com/v1/dealFields:(key,name,options)?start=0&api_token={}'.format(domain, token)
+
+    resp = CLIENT.get(url)
+    return resp.json()['data']
+
+
+class FieldIndex:
+    '''Two-level index over the dealFields schema: field name to key, and
+       key to option id to option label'''
+
+    def __init__(self):
+        self.keys = {}
+        self.names = {}
+        self.options = {}
+
+    def add(self, key, name, options=None):
+        '''Index a field, and its option labels if it has any'''
+        self.keys[name] = key
+        self.names[key] = name
+        if options is not None:
+            self.options[key] = {'{}'.format(option['id']): option['label'] for option in options}
+
+    def resolve(self, key, value):
+        '''Return the option label for value, or value itself for fields without options'''
+        options = self.options.get(key)
+        if options is None:
+            return value
+        return options.get('{}'.format(value))
+
+    def value(self, name, current):
+        '''Return the resolved value of the named field on a deal'''
+        key = self.keys.get(name)
+        if key is None:
+            return None
+        return self.resolve(key, current.get(key))
+
+
+def index_fields(fields):
+    '''Index every field by its name with the spaces removed'''
+    field_index = FieldIndex()
+    for field in fields:
+        field_index.add(field['key'], field['name'].replace(' ', ''))
+    return field_index
+
+
+class DealFieldsCache:
+    '''Keeps the dealFields schema, and anything built from it, between warm
+       invocations so only the first event per TTL pays for the round trip'''
+
+    def __init__(self, ttl=DEAL_FIELDS_TTL, fetch=fetch_deal_fields, clock=time.monotonic,
+                 min_age=DEAL_FIELDS_MIN_AGE):
+        self.ttl = ttl
+        self.fetch = fetch
+        self.clock = clock
+        self.min_age = min_age
+        self.version = 0
+        self._domain = None
+        self._fields = None
+        self._fetched_at = 0
+        self._expires_at = 0
+        self._derived = {}
+        # (version, names) of fields known to be missing from that schema
+        self._missing = (0, frozenset())
+
+    def get(self, domain, token):
+        '''Return the cached schema, fetching it if it is missing or stale'''
+        if self._fields is None or domain != self._domain or self.clock() >= self._expires_at:
+            fields = self.fetch(domain, token)
+            self._domain = domain
+            self._fields = fields
+            self._fetched_at = self.clock()
+            self._expires_at = self._fetched_at + self.ttl
+            self._derived = {}
+            self.version += 1
+        return self._fields
+
+    def derive(self, name, builder, domain, token):
+        '''Return builder(fields), rebuilding it only when the schema changes'''
+        fields = self.get(domain, token)
+        if name not in self._derived:
+            self._derived[name] = builder(fields)
+        return self._derived[name]
+
+    def refetch_missing(self, names, domain, token):
+        '''Refetch the schema because it lacks the fields in names, for
+           instance after they were added in Pipedrive. Names already missing
+           from this schema, or a schema younger than min_age, do not refetch.
+           Either way names are remembered as missing until the schema next
+           changes. Returns True if the schema was refetched'''
+        names = frozenset(names)
+        (version, missing) = self._missing
+        known = missing if version == self.version else frozenset()
+        refetch = not names <= known and self.clock() - self._fetched_at >= self.min_age
+        if refetch:
+            self.invalidate()
+            self.get(domain, token)
+            known = frozenset()
+        self._missing = (self.version, known | names)
+        return refetch
+
+    def invalidate(self):
+        '''Drop the cached schema so the next lookup refetches it'''
+        self._fields = None
+        self._expires_at = 0
+        self._derived = {}
+
+
+DEAL_FIELDS = DealFieldsCache()
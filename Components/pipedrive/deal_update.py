@@ -7,54 +7,22 @@ import sys
 
 import boto3
 from botocore.exceptions import ClientError
-import requests
+from credentials import CREDENTIALS
+from deal_fields import DEAL_FIELDS, index_fields
+from errors import WorthRetryingException, ExternalAPIFailed
+from pipedrive_client import CLIENT
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.WARNING)
 
-PIPEDRIVE_API_TOKEN_PATH = env.get('API_TOKEN_PATH')
 PIPEDRIVE_SNS_TOPIC_ARN = env.get('PIPEDRIVE_SNS_TOPIC_ARN')
 SNS = boto3.client('sns')
 
 
-class WorthRetryingException(Exception):
-    '''Base error class'''
-
-
-class ExternalAPIFailed(WorthRetryingException):
-    '''External API error class'''
-
-
-class TemporaryGlitch(WorthRetryingException):
-    '''Idempotent Glitch error class'''
-
-
 class SnsPublishError(Exception):
     '''SNS publish error'''
 
 
-class PipedriveRequestError(WorthRetryingException):
-    '''Pipedrive Request error'''
-
-
-def fetch_api_token(credential_path):
-    """ Fetch and return the PipeDrive API token """
-    ssm = boto3.client('ssm')
-    parameter = ssm.get_parameter(Name=credential_path, WithDecryption=True)
-    return parameter['Parameter']['Value']
-
-
-def get_company_domain(api_token):
-    '''Pipedrive call using the api token to return the company domain'''
-    url = 'https://api.pipedrive.com/v1/users/me?api_token=' + api_token
-
-    resp = requests.get(url)
-    resp.raise_for_status()
-    response = resp.json()['data']['company_domain']
-
-    return response
-
-
 def build_sns_message(message, fields_to_update):
     '''Construct SNS message and include info about the fields that were updated'''
     sns_message = {
@@ -106,76 +74,99 @@ def publish_sns_message(sns_topic_arn, message, attributes):
 
 
 def get_pipedrive_credentials():
-    '''Retrieve Pipedrive credentials'''
+    '''Retrieve Pipedrive credentials from the process-wide cache'''
     try:
-        token = fetch_api_token(PIPEDRIVE_API_TOKEN_PATH)
-        domain = get_company_domain(token)
-    except (ClientError, requests.exceptions.HTTPError) as errc:
+        token, domain = CREDENTIALS.get()
+    except ClientError as errc:
         LOGGER.exception(errc)
         exc_info = sys.exc_info()
         raise ExternalAPIFailed(errc).with_traceback(exc_info[2])
-    except requests.exceptions.RequestException as errr:
-        LOGGER.exception(errr)
-        exc_info = sys.exc_info()
-        raise PipedriveRequestError(errr).with_traceback(exc_info[2])
+    except WorthRetryingException as errw:
+        LOGGER.exception(errw)
+        raise
 
     return token, domain
 
 def get_deal_fields(domain, token, fields_to_update):
     '''Retrieve all Deal Fields from Pipedrive and return a formatted dict
        with only the Deal Field that are going to be updated'''
-    url = 'https://{}.pipedrive.com/v1/dealFields:(key,name)?start=0&api_token={}'.format(domain, token)
-    formatted_fields = {}
-
     try:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        fields = resp.json()['data']
-    except (ClientError, requests.exceptions.HTTPError) as errc:
-        LOGGER.exception(errc)
-        exc_info = sys.exc_info()
-        raise ExternalAPIFailed(errc).with_traceback(exc_info[2])
-    except requests.exceptions.RequestException as error:
-        LOGGER.exception(error)
-        exc_info = sys.exc_info()
-        raise PipedriveRequestError(error).with_traceback(exc_info[2])
+        field_index = DEAL_FIELDS.derive('field_index', index_fields, domain, token)
+
+        # A field we were asked to update is missing from the cached schema,
+        # possibly because it was added in Pipedrive since we last fetched.
+        # Many link names never have a deal field, so this refetches rarely
+        missing = [name for name in fields_to_update if name not in field_index.keys]
+        if missing and DEAL_FIELDS.refetch_missing(missing, domain, token):
+            field_index = DEAL_FIELDS.derive('field_index', index_fields, domain, token)
+        formatted_fields = format_deal_fields(field_index, fields_to_update)
+    except WorthRetryingException as errw:
+        CREDENTIALS.invalidate_if_unauthorized(errw)
+        LOGGER.exception(errw)
+        raise
 
-    for field in fields:
-        for (key, value) in fields_to_update.items():
-            if field['name'].replace(' ', '') == key:
-                formatted_fields.update({key : {field['key'] : value}})
+    return formatted_fields
+
+
+def format_deal_fields(field_index, fields_to_update):
+    '''Map each field name to be updated onto its Pipedrive key'''
+    formatted_fields = {}
+    for (key, value) in fields_to_update.items():
+        if key in field_index.keys:
+            formatted_fields.update({key : {field_index.keys[key] : value}})
 
     return formatted_fields
 
 
-def update_deal_field(domain, token, deal_id, field_name, field_value):
-    '''PUT call to Pipedrive to update Deal Field with new value'''
+def get_deal(domain, token, deal_id):
+    '''GET call to Pipedrive to retrieve the Deal's current field values'''
     url = 'https://{}.pipedrive.com/v1/deals/{}?api_token={}'.format(domain, deal_id, token)
 
+    try:
+        resp = CLIENT.get(url)
+        deal = resp.json()['data']
+        if deal is None:
+            raise ExternalAPIFailed('Deal {} not found'.format(deal_id))
+    except WorthRetryingException as errw:
+        CREDENTIALS.invalidate_if_unauthorized(errw)
+        LOGGER.exception(errw)
+        raise
+
+    return deal
+
+
+def changed_deal_fields(deal, fields_to_update):
+    '''Merge the formatted fields into one PUT body, leaving out fields
+       whose value on the Deal is already the same'''
     data = {}
-    data[field_name] = field_value
+    for links in fields_to_update.values():
+        for (key, value) in links.items():
+            if deal.get(key) != value:
+                data[key] = value
+
+    return data
+
+
+def update_deal_fields(domain, token, deal_id, data):
+    '''PUT call to Pipedrive to update all changed Deal Fields at once'''
+    url = 'https://{}.pipedrive.com/v1/deals/{}?api_token={}'.format(domain, deal_id, token)
 
     try:
-        resp = requests.put(
+        resp = CLIENT.put(
             url,
             data=data
         )
-        resp.raise_for_status()
         result = resp.json()
         if result['data'] is None:
-            raise ExternalAPIFailed('Updating {} field failed'.format(field_name))
+            raise ExternalAPIFailed('Updating {} fields failed'.format(', '.join(data)))
         elif result['data']['id'] is not None:
             return
         else:
-            raise Exception("Updating {} field was unsuccessful".format(field_name))
-    except (ClientError, requests.exceptions.HTTPError) as errc:
-        LOGGER.exception(errc)
-        exc_info = sys.exc_info()
-        raise ExternalAPIFailed(errc).with_traceback(exc_info[2])
-    except requests.exceptions.RequestException as error:
-        LOGGER.exception(error)
-        exc_info = sys.exc_info()
-        raise PipedriveRequestError(error).with_traceback(exc_info[2])
+            raise Exception("Updating {} fields was unsuccessful".format(', '.join(data)))
+    except WorthRetryingException as errw:
+        CREDENTIALS.invalidate_if_unauthorized(errw)
+        LOGGER.exception(errw)
+        raise
 
 
 def format_response(message):
@@ -201,10 +192,17 @@ def lambda_handler(event, context):
         else:
             fields_to_update = get_deal_fields(domain, token, message['CopiedFileLinks'])
 
-        if fields_to_update is not None:
-            for (name, links) in fields_to_update.items():
-                for (key, value) in links.items():
-                    update_deal_field(domain, token, message['DealId'], key, value)
+        if fields_to_update:
+            data = changed_deal_fields({}, fields_to_update)
+            # Reading the deal only pays off when it can leave out some of
+            # several fields, a single field is simply written again
+            if len(data) > 1:
+                deal = get_deal(domain, token, message['DealId'])
+                data = changed_deal_fields(deal, fields_to_update)
+            if data:
+                update_deal_fields(domain, token, message['DealId'], data)
+            else:
+                print('Deal {} fields already up to date'.format(message['DealId']))
 
         # Construct SNS message
         sns_message = build_sns_message(message, fields_to_update)
@@ -216,20 +214,20 @@ def lambda_handler(event, context):
                                            message_attributes)
         response['body'] = format_response(sns_response)
 
+    except WorthRetryingException:
+        # Fail the invocation so Lambda retries the SNS delivery and then
+        # hands it to the dead letter queue. A rate limited update
+        # (RateLimitExceeded) is deferred this way instead of being lost
+        raise
     except Exception as error:
-        if isinstance(error, WorthRetryingException):
-            raise error
+        LOGGER.exception(error)
+        response['statusCode'] = 500
+        message = {
+            'error': {
+                'type': type(error).__name__,
+                'description': str(error),
+            },
+        }
+        response['body'] = format_response(message)
 
-        else:
-            LOGGER.exception(error)
-            response['statusCode'] = 500
-            message = {
-                'error': {
-                    'type': type(error).__name__,
-                    'description': str(error),
-                },
-            }
-            response['body'] = format_response(message)
-
-    finally:
-        return response
+    return response
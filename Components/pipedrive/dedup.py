@@ -0,0 +1,126 @@
+'''Idempotency store that drops redelivered Pipedrive webhooks'''
+
+from os import environ as env
+import logging
+import json
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+LOGGER = logging.getLogger()
+
+DEDUP_TABLE = env.get('DEDUP_TABLE', 'pipedrive-webhook-events')
+DEDUP_TTL = int(env.get('DEDUP_TTL', '86400'))
+# Longer than the function timeout, so only a delivery that died mid-way expires
+DEDUP_LEASE = int(env.get('DEDUP_LEASE', '180'))
+METRIC_NAMESPACE = 'pipedrive-automation'
+DDB = boto3.resource('dynamodb', region_name='us-east-1')
+
+
+def delivery_key(deal):
+    '''Build the idempotency key for a webhook from its event, deal id and
+       the microsecond timestamp Pipedrive stamps on the event. Redeliveries
+       repeat the timestamp, two updates made in the same second do not.
+       Returns None when the payload carries no metadata'''
+    try:
+        return '{}:{}:{}'.format(deal['event'], deal['meta']['id'], deal['meta']['timestamp_micro'])
+    except (KeyError, TypeError):
+        return None
+
+
+class DeliveryStore:
+    '''Records each webhook delivery with a conditional put so a redelivery
+       can be recognised before any other work is done.
+
+       A claim is only a lease until complete() marks the delivery done. If
+       the invocation dies first the lease runs out and a redelivery is
+       processed again'''
+
+    def __init__(self, table_name=DEDUP_TABLE, ttl=DEDUP_TTL, lease=DEDUP_LEASE, clock=time.time):
+        self.table_name = table_name
+        self.table = DDB.Table(table_name)
+        self.ttl = ttl
+        self.lease = lease
+        self.clock = clock
+        self.deliveries = 0
+        self.duplicates = 0
+
+    @property
+    def hit_rate(self):
+        '''Share of deliveries seen by this container that were duplicates'''
+        if not self.deliveries:
+            return 0.0
+        return self.duplicates / self.deliveries
+
+    def claim(self, key):
+        '''Return True if this is the first delivery of key, False for a
+           duplicate. The claim is held as in_progress for the lease'''
+        now = int(self.clock())
+        try:
+            self.table.put_item(
+                Item={
+                    'event_key': key,
+                    'delivery_state': 'in_progress',
+                    'expires_at': now + self.lease
+                },
+                # DynamoDB removes expired items lazily, so treat them as absent.
+                # That includes the lease of a delivery that never completed
+                ConditionExpression='attribute_not_exists(event_key) OR expires_at < :now',
+                ExpressionAttributeValues={':now': now}
+            )
+            duplicate = False
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                # Fail open; processing a duplicate beats dropping a new event
+                LOGGER.exception(error)
+                return True
+            duplicate = True
+
+        self.record(duplicate)
+        return not duplicate
+
+    def complete(self, key):
+        '''Mark a claimed delivery done, keeping it for the full ttl'''
+        now = int(self.clock())
+        try:
+            self.table.update_item(
+                Key={'event_key': key},
+                UpdateExpression='set delivery_state = :done, expires_at = :expires',
+                ExpressionAttributeValues={':done': 'done', ':expires': now + self.ttl}
+            )
+        except ClientError as error:
+            # The lease still covers redeliveries until it runs out
+            LOGGER.exception(error)
+
+    def release(self, key):
+        '''Forget a delivery so a retry of it is processed again'''
+        try:
+            self.table.delete_item(Key={'event_key': key})
+        except ClientError as error:
+            LOGGER.exception(error)
+
+    def record(self, duplicate):
+        '''Count a delivery and emit it as a CloudWatch embedded metric'''
+        self.deliveries += 1
+        self.duplicates += int(duplicate)
+        print(json.dumps({
+            '_aws': {
+                'Timestamp': int(self.clock() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRIC_NAMESPACE,
+                    'Dimensions': [['Table']],
+                    'Metrics': [
+                        {'Name': 'WebhookDeliveries', 'Unit': 'Count'},
+                        {'Name': 'WebhookDuplicates', 'Unit': 'Count'}
+                    ]
+                }]
+            },
+            'Table': self.table_name,
+            'WebhookDeliveries': 1,
+            'WebhookDuplicates': int(duplicate),
+            'WebhookDuplicateHitRate': self.hit_rate
+        }))
+
+
+DELIVERIES = DeliveryStore()
@@ -0,0 +1,17 @@
+'''Error classes shared by the pipedrive component'''
+
+
+class WorthRetryingException(Exception):
+    '''Base error class'''
+
+
+class ExternalAPIFailed(WorthRetryingException):
+    '''External API error class'''
+
+
+class TemporaryGlitch(WorthRetryingException):
+    '''Idempotent Glitch error class'''
+
+
+class PipedriveRequestError(WorthRetryingException):
+    '''Pipedrive Request error'''
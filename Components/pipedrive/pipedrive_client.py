@@ -0,0 +1,114 @@
+'''Pooled, retrying HTTP client shared by every Pipedrive call'''
+
+from os import environ as env
+import logging
+import random
+import sys
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from errors import ExternalAPIFailed, PipedriveRequestError
+from rate_limit import RATE_LIMIT_TABLE, TokenBucket
+
+LOGGER = logging.getLogger()
+
+PIPEDRIVE_CONNECT_TIMEOUT = float(env.get('PIPEDRIVE_CONNECT_TIMEOUT', '3.05'))
+PIPEDRIVE_READ_TIMEOUT = float(env.get('PIPEDRIVE_READ_TIMEOUT', '10'))
+PIPEDRIVE_RETRIES = int(env.get('PIPEDRIVE_RETRIES', '3'))
+# Budget for one call, retries included. An event makes up to three calls
+# and the functions time out after 60s
+PIPEDRIVE_REQUEST_DEADLINE = float(env.get('PIPEDRIVE_REQUEST_DEADLINE', '15'))
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class PipedriveClient:
+    '''Keep-alive session to *.pipedrive.com that is reused across warm
+       invocations. 429s, 5xx responses and connection failures are retried
+       with exponential backoff and full jitter. Anything still failing is
+       raised as ExternalAPIFailed (HTTP errors) or PipedriveRequestError
+       (everything else), with the requests exception as its cause.
+       A call gives up retrying once another attempt would not fit in its
+       deadline, and no attempt waits on a read past it.
+       With a limiter, every attempt first takes a token from it'''
+
+    def __init__(self, timeout=(PIPEDRIVE_CONNECT_TIMEOUT, PIPEDRIVE_READ_TIMEOUT), retries=PIPEDRIVE_RETRIES,
+                 backoff=0.5, max_backoff=8, session=None, sleep=time.sleep, limiter=None,
+                 deadline=PIPEDRIVE_REQUEST_DEADLINE, clock=time.monotonic):
+        self.timeout = timeout
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.deadline = deadline
+        self.clock = clock
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=10))
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        '''Send a request, retrying transient failures, and return the response'''
+        started = self.clock()
+        timeout = kwargs.pop('timeout', None)
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            try:
+                resp = self.session.request(method, url, timeout=timeout or self.attempt_timeout(started), **kwargs)
+                if self.limiter is not None:
+                    self.limiter.observe(resp.headers)
+                if resp.status_code in RETRY_STATUS_CODES and self.retry(attempt, started, resp):
+                    attempt += 1
+                    continue
+                resp.raise_for_status()
+                return resp
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+                if self.retry(attempt, started):
+                    LOGGER.warning('Retrying Pipedrive %s after %s', method, type(error).__name__)
+                    attempt += 1
+                    continue
+                exc_info = sys.exc_info()
+                raise PipedriveRequestError(error).with_traceback(exc_info[2]) from error
+            except requests.exceptions.HTTPError as errh:
+                exc_info = sys.exc_info()
+                raise ExternalAPIFailed(errh).with_traceback(exc_info[2]) from errh
+            except requests.exceptions.RequestException as error:
+                exc_info = sys.exc_info()
+                raise PipedriveRequestError(error).with_traceback(exc_info[2]) from error
+
+    def attempt_timeout(self, started):
+        '''(connect, read) timeout of an attempt, the read cut to the time left'''
+        (connect, read) = self.timeout
+        remaining = started + self.deadline - self.clock()
+        return connect, max(connect, min(read, remaining))
+
+    def retry(self, attempt, started, resp=None):
+        '''Sleep before the next attempt and return True, or return False when
+           the retries are used up or the attempt would overrun the deadline.
+           Retry-After on a 429 is honoured'''
+        if attempt >= self.retries:
+            return False
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if resp is not None and resp.headers.get('Retry-After', '').isdigit():
+            delay = max(delay, min(self.max_backoff, int(resp.headers['Retry-After'])))
+        # The next attempt needs at least its connect timeout
+        if self.clock() + delay + self.timeout[0] > started + self.deadline:
+            LOGGER.warning('Not retrying Pipedrive, %.1fs deadline reached', self.deadline)
+            return False
+        self.sleep(delay)
+        return True
+
+    def get(self, url, **kwargs):
+        '''GET url'''
+        return self.request('GET', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        '''PUT url'''
+        return self.request('PUT', url, **kwargs)
+
+
+CLIENT = PipedriveClient(limiter=TokenBucket() if RATE_LIMIT_TABLE else None)
@@ -0,0 +1,124 @@
+'''Token bucket for the Pipedrive API, shared by every Lambda through DynamoDB'''
+
+from os import environ as env
+import logging
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from errors import TemporaryGlitch
+
+LOGGER = logging.getLogger()
+
+RATE_LIMIT_TABLE = env.get('RATE_LIMIT_TABLE')
+PIPEDRIVE_RATE_LIMIT = int(env.get('PIPEDRIVE_RATE_LIMIT', '80'))
+PIPEDRIVE_RATE_WINDOW = float(env.get('PIPEDRIVE_RATE_WINDOW', '2'))
+RATE_LIMIT_MAX_WAIT = float(env.get('RATE_LIMIT_MAX_WAIT', '5'))
+DDB = boto3.resource('dynamodb', region_name='us-east-1')
+
+
+class RateLimitExceeded(TemporaryGlitch):
+    '''Pipedrive budget will not refill soon enough, defer the work'''
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    '''Refills at capacity/window tokens per second. The bucket lives in one
+       DynamoDB item updated with optimistic locking, so every webhook and
+       deal_update instance draws from the same budget. Pipedrive's
+       X-RateLimit-* headers pull the bucket down to the server's view.
+       DynamoDB errors fail open, the limiter never blocks a call on its own'''
+
+    def __init__(self, table_name=RATE_LIMIT_TABLE, bucket='pipedrive', capacity=PIPEDRIVE_RATE_LIMIT,
+                 window=PIPEDRIVE_RATE_WINDOW, max_wait=RATE_LIMIT_MAX_WAIT, clock=time.time, sleep=time.sleep):
+        self.table = DDB.Table(table_name)
+        self.bucket = bucket
+        self.capacity = capacity
+        self.window = window
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+
+    @property
+    def rate(self):
+        '''Tokens added per second'''
+        return self.capacity / self.window
+
+    def acquire(self):
+        '''Take one token, waiting up to max_wait for it. Raises
+           RateLimitExceeded if the bucket will not refill in time'''
+        waited = 0
+        while True:
+            try:
+                wait = self._take()
+            except ClientError as error:
+                LOGGER.exception(error)
+                return
+            if wait <= 0:
+                return
+            if waited + wait > self.max_wait:
+                raise RateLimitExceeded('Pipedrive rate limit reached, retry in {:.1f}s'.format(wait), wait)
+            self.sleep(wait)
+            waited += wait
+
+    def observe(self, headers):
+        '''Sync the bucket with the X-RateLimit-* headers of a Pipedrive response'''
+        if 'X-RateLimit-Remaining' not in headers:
+            return
+        if 'X-RateLimit-Limit' in headers:
+            self.capacity = int(headers['X-RateLimit-Limit'])
+
+        remaining = int(headers['X-RateLimit-Remaining'])
+        # Only spend a write when the server says we are nearly out
+        if remaining > self.capacity // 10:
+            return
+
+        now = self.clock()
+        updated_at = now
+        if remaining == 0:
+            # Nothing refills until the server's window resets
+            updated_at = now + float(headers.get('X-RateLimit-Reset', self.window))
+        try:
+            self.table.put_item(
+                Item={
+                    'bucket': self.bucket,
+                    'tokens': str(remaining),
+                    'updated_at': str(updated_at)
+                }
+            )
+        except ClientError as error:
+            LOGGER.exception(error)
+
+    def _take(self):
+        '''Try to take a token. Returns 0 on success or the seconds until one is available'''
+        while True:
+            now = self.clock()
+            item = self.table.get_item(Key={'bucket': self.bucket}, ConsistentRead=True).get('Item')
+            if item is None:
+                tokens, updated_at = float(self.capacity), now
+            else:
+                tokens, updated_at = float(item['tokens']), float(item['updated_at'])
+
+            tokens = min(float(self.capacity), tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+
+            try:
+                self.table.put_item(
+                    Item={
+                        'bucket': self.bucket,
+                        'tokens': str(tokens - 1),
+                        'updated_at': str(now)
+                    },
+                    ConditionExpression='attribute_not_exists(updated_at) OR updated_at = :u',
+                    ExpressionAttributeValues={':u': item['updated_at'] if item else ''}
+                )
+                return 0
+            except ClientError as error:
+                if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # Another instance took a token first, look again straight away
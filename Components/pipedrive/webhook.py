@@ -1,11 +1,17 @@
 from os import environ as env
+import hashlib
 import logging
 import json
+import math
 import sys
 
 import boto3
 from botocore.exceptions import ClientError
-import requests
+from credentials import CREDENTIALS
+from deal_fields import DEAL_FIELDS, FieldIndex
+from dedup import DELIVERIES, delivery_key
+from errors import WorthRetryingException
+from rate_limit import RateLimitExceeded
 
 LOGGER = logging.getLogger()
 LOGGER.setLevel(logging.WARNING)
@@ -20,23 +26,13 @@ STAGE = {
 }
 
 PIPEDRIVE_SNS_TOPIC_ARN = env.get('PIPEDRIVE_SNS_TOPIC_ARN')
-API_TOKEN_PATH = env.get('API_TOKEN_PATH')
+WEBHOOK_QUEUE_URL = env.get('WEBHOOK_QUEUE_URL')
+SNS_BATCH_SIZE = 10
 SNS = boto3.client('sns')
+SQS = boto3.client('sqs')
 DDB = boto3.resource('dynamodb', region_name='us-east-1')
 
 
-class WorthRetryingException(Exception):
-    '''Base error class'''
-
-
-class ExternalAPIFailed(WorthRetryingException):
-    '''External API error class'''
-
-
-class TemporaryGlitch(WorthRetryingException):
-    '''Idempotent Glitch error class'''
-
-
 class DynamoDBError(WorthRetryingException):
     '''DynamoDB error'''
 
@@ -49,6 +45,14 @@ class RegressiveStageUpdateError(Exception):
     '''Error class to handle when a pipedrive stage is lower than its previous'''
 
 
+class InvalidWebhookError(Exception):
+    '''Webhook payload cannot be processed'''
+
+
+class StaleDealEventError(Exception):
+    '''Error class to handle an event older than the one already recorded for its deal'''
+
+
 def build_message_attributes(deal_event, stage, current):
     '''Construct message attributes based on deal_event'''
     message_attributes = {
@@ -94,18 +98,58 @@ def publish_sns_message(sns_topic_arn, message, attributes):
     return resp
 
 
+def publish_sns_batch(sns_topic_arn, messages):
+    '''Publish (message, attributes) pairs to SNS topic, up to 10 per call.
+       Raises SnsPublishError naming every message SNS rejected'''
+    successful = []
+    failed = []
+    for start in range(0, len(messages), SNS_BATCH_SIZE):
+        entries = []
+        for index, (message, attributes) in enumerate(messages[start:start + SNS_BATCH_SIZE], start):
+            print('SNS message: {}'.format(message))
+            entries.append({
+                'Id': '{}-{}'.format(index, attributes['stage']['StringValue']),
+                'Message': json.dumps(message),
+                'MessageAttributes': attributes
+            })
+        try:
+            resp = SNS.publish_batch(
+                TopicArn=sns_topic_arn,
+                PublishBatchRequestEntries=entries
+            )
+        except ClientError as errc:
+            exc_info = sys.exc_info()
+            raise SnsPublishError(errc).with_traceback(exc_info[2])
+
+        print('SNS Response: {}'.format(resp))
+        successful.extend(resp.get('Successful', []))
+        failed.extend(resp.get('Failed', []))
+
+    if failed:
+        raise SnsPublishError('{} of {} messages failed to publish: {}'.format(
+            len(failed), len(messages), failed))
+
+    return {'Successful': successful, 'Failed': failed}
+
+
+def new_deal_message(deal, deal_event, stage):
+    '''Construct the SNS message and attributes announcing a new deal'''
+    sns_message = {
+        'CustomerName': deal['current']['org_name'],
+        'ProjectName': deal['current']['title'],
+        'ShortName': deal['current']['b3ac74b4fdba3bb5fe7277f0a75d17da65ee759b'],
+        'EventType': deal_event,
+        'DealId': deal['current']['id']
+    }
+
+    message_attributes = build_message_attributes(deal_event, stage, deal['current'])
+    return sns_message, message_attributes
+
+
 def new_deal(deal, deal_event, stage, sns_topic_arn):
     '''Workflow for new deal'''
     try:
-        sns_message = {
-            'CustomerName': deal['current']['org_name'],
-            'ProjectName': deal['current']['title'],
-            'ShortName': deal['current']['b3ac74b4fdba3bb5fe7277f0a75d17da65ee759b'],
-            'EventType': deal_event,
-            'DealId': deal['current']['id']
-        }
-
-        message_attributes = build_message_attributes(deal_event, stage, deal['current'])
+        sns_message, message_attributes = new_deal_message(deal, deal_event, stage)
 
         # Publish a message to Pipedrive Topic
         sns_response = publish_sns_message(sns_topic_arn,
@@ -123,59 +167,71 @@ def new_deal(deal, deal_event, stage, sns_topic_arn):
     return response
 
 
+def updated_deal_messages(deal, deal_event, stages):
+    '''Construct an updated.deal SNS message and attributes for each stage.
+       Credentials and the field map are loaded once for all of them.
+       Returns an empty list when the stage has not changed'''
+    # Compare differences between current and previous in deal
+    current = deal['current']
+    previous = deal['previous']
+    diff = {}
+
+    # If the stage hasn't changed, do not send SNS message
+    if deal_event != 'added.deal':
+        if current['status'] != 'won':
+            if current['stage_id'] == previous['stage_id']:
+                return []
+
+    # If the stage id has decreased, do not send SNS message
+    if previous:
+        if current['stage_id'] < previous['stage_id']:
+            raise RegressiveStageUpdateError('Current stage is less than previous stage')
+
+        diff = {k : current[k] for k, v in set(current.items()) - set(previous.items())}
+
+        # Only the latest stage becomes deal_closure, any caught up stages keep their own name
+        if 'status' in diff.keys():
+            if diff['status'] == 'won':
+                stages = stages[:-1] + ['deal_closure']
+    # Load pipedrive credentials
+    token, domain = get_pipedrive_credentials()
+    # Build dict describing relationship between key and options. Both the
+    # deal fields and the map are cached between warm invocations
+    map_items = ['Territory', 'Solution Program', 'Deal Type']
+
+    field_map = DEAL_FIELDS.derive('field_map',
+                                   lambda fields: build_field_map(fields, map_items),
+                                   domain, token)
+
+    # Construct SNS message
+    sns_message = {
+        'CustomerName': deal['current']['org_name'],
+        'ProjectName': deal['current']['title'],
+        'ShortName': deal['current']['b3ac74b4fdba3bb5fe7277f0a75d17da65ee759b'],
+        'EventType': deal_event,
+        'Territory': get_deal_field(field_map, 'Territory', current),
+        'DealType': get_deal_field(field_map, 'DealType', current),
+        'SolutionProgram': get_deal_field(field_map, 'SolutionProgram', current),
+        'SOWLink': get_deal_field(field_map, 'SOWLink', current),
+        'GDriveLink': get_deal_field(field_map, 'GDriveLink', current),
+        'APNPortalOppLink': get_deal_field(field_map, 'APNPortalOppLink', current),
+        'DealId': deal['current']['id'],
+        'Updates': build_update_message(current, diff, field_map)
+    }
+
+    return [(sns_message, build_message_attributes('updated.deal', stage, current)) for stage in stages]
+
+
 def updated_deal(deal, deal_event, stage):
     '''Workflow for updated deal'''
     try:
         response = {'statusCode': 200}
-        # Compare differences between current and previous in deal
-        current = deal['current']
-        previous = deal['previous']
-        diff = {}
-
-        # If the stage hasn't changed, do not send SNS message
-        if deal_event != 'added.deal':
-            if current['status'] != 'won':
-                if current['stage_id'] == previous['stage_id']:
-                    response = {'statusCode': 202}
-                    return response
-
-        # If the stage id has decreased, do not send SNS message
-        if previous:
-            if current['stage_id'] < previous['stage_id']:
-                raise RegressiveStageUpdateError('Current stage is less than previous stage')
-
-            diff = {k : current[k] for k, v in set(current.items()) - set(previous.items())}
-
-            if 'status' in diff.keys():
-                if diff['status'] == 'won':
-                    stage = 'deal_closure'
-        # Load pipedrive credentials
-        token, domain = get_pipedrive_credentials()
-        # Grab all the deal fields and their information
-        deal_fields = get_deal_fields(domain, token)
-        # Build dict describing relationship between key and options
-        map_items = ['Territory', 'Solution Program', 'Deal Type']
-
-        field_map = build_field_map(deal_fields, map_items)
-        # updates = build_update_message(current, diff, field_map)
-
-        # Construct SNS message
-        sns_message = {
-            'CustomerName': deal['current']['org_name'],
-            'ProjectName': deal['current']['title'],
-            'ShortName': deal['current']['b3ac74b4fdba3bb5fe7277f0a75d17da65ee759b'],
-            'EventType': deal_event,
-            'Territory': get_deal_field(field_map, 'Territory', current),
-            'DealType': get_deal_field(field_map, 'DealType', current),
-            'SolutionProgram': get_deal_field(field_map, 'SolutionProgram', current),
-            'SOWLink': get_deal_field(field_map, 'SOWLink', current),
-            'GDriveLink': get_deal_field(field_map, 'GDriveLink', current),
-            'APNPortalOppLink': get_deal_field(field_map, 'APNPortalOppLink', current),
-            'DealId': deal['current']['id'],
-            'Updates': build_update_message(current, diff, field_map)
-        }
+        messages = updated_deal_messages(deal, deal_event, [stage])
+        if not messages:
+            response = {'statusCode': 202}
+            return response
 
-        message_attributes = build_message_attributes('updated.deal', stage, current)
+        sns_message, message_attributes = messages[0]
 
         # Publish a message to Pipedrive Topic
         sns_response = publish_sns_message(PIPEDRIVE_SNS_TOPIC_ARN,
@@ -184,6 +240,11 @@ def updated_deal(deal, deal_event, stage):
         response['body'] = format_response(sns_response)
     except (RegressiveStageUpdateError, SnsPublishError) as errs:
         raise Exception(errs)
+    except WorthRetryingException as errw:
+        # Drop a rejected token so the redelivered webhook reloads it from SSM
+        CREDENTIALS.invalidate_if_unauthorized(errw)
+        LOGGER.exception(errw)
+        raise
     except Exception as error:
         LOGGER.exception(error)
         exc_info = sys.exc_info()
@@ -192,8 +253,41 @@ def updated_deal(deal, deal_event, stage):
     return response
 
 
-def put_deal_db(deal):
-    '''Add a new deal to the Pipedrive Deal DB'''
+def catch_up_deal(deal, deal_event, stages):
+    '''Workflow for a deal first seen past lead_in. The new deal message and
+       one updated.deal message per stage it skipped are published together'''
+    try:
+        response = {'statusCode': 200}
+        messages = [new_deal_message(deal, 'added.deal', 'lead_in')]
+        messages.extend(updated_deal_messages(deal, deal_event, stages))
+
+        # Publish all messages to Pipedrive Topic
+        sns_response = publish_sns_batch(PIPEDRIVE_SNS_TOPIC_ARN, messages)
+        response['body'] = format_response(sns_response)
+    except (RegressiveStageUpdateError, SnsPublishError) as errs:
+        raise Exception(errs)
+    except WorthRetryingException as errw:
+        # Drop a rejected token so the redelivered webhook reloads it from SSM
+        CREDENTIALS.invalidate_if_unauthorized(errw)
+        LOGGER.exception(errw)
+        raise
+    except Exception as error:
+        LOGGER.exception(error)
+        exc_info = sys.exc_info()
+        raise Exception(error).with_traceback(exc_info[2])
+
+    return response
+
+
+def event_version(deal):
+    '''Microsecond timestamp Pipedrive stamps on each webhook. Unlike
+       update_time it still tells apart two updates made in the same second'''
+    return deal['meta']['timestamp_micro']
+
+
+def put_deal_db(deal, version):
+    '''Add a new deal to the Pipedrive Deal DB. Raises StaleDealEventError if
+       another event has already recorded the deal'''
     table = DDB.Table('pipedrive-deals')
 
     try:
@@ -204,17 +298,39 @@ def put_deal_db(deal):
                 'deal_id': deal['id'],
                 'current_stage': deal['stage_id'],
                 'pipeline_id': deal['pipeline_id'],
-                'deal_status': deal['status']
-            }
+                'deal_status': deal['status'],
+                'event_version': version
+            },
+            ConditionExpression='attribute_not_exists(customer)'
         )
     except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise StaleDealEventError('Deal {} has already been recorded'.format(deal['id']))
         LOGGER.exception(error)
         exc_info = sys.exc_info()
         raise DynamoDBError(error).with_traceback(exc_info[2])
 
 
+def delete_deal_db(deal, version):
+    '''Removes a deal recorded by put_deal_db so a retried event can record it again'''
+    table = DDB.Table('pipedrive-deals')
+
+    try:
+        response = table.delete_item(
+            Key={
+                'customer': deal['org_name'],
+                'project': deal['title']
+            },
+            ConditionExpression='event_version = :v',
+            ExpressionAttributeValues={':v': version}
+        )
+    except ClientError as error:
+        LOGGER.exception(error)
+
+
 def update_deal_db(deal):
-    '''Updates the pipedrive-deals DDB table with the current status and the current stage_id'''
+    '''Updates the pipedrive-deals DDB table with the current status and the current stage_id.
+       Raises StaleDealEventError if the table already holds a later stage or version'''
     table = DDB.Table('pipedrive-deals')
 
     try:
@@ -223,16 +339,33 @@ def update_deal_db(deal):
                 'customer': deal['current']['org_name'],
                 'project': deal['current']['title'],
             },
-            UpdateExpression="set current_stage = :cs, deal_status = :s",
-            ExpressionAttributeValues={':cs': deal['current']['stage_id'], ':s': deal['current']['status']},
+            UpdateExpression="set current_stage = :cs, deal_status = :s, event_version = :v",
+            ConditionExpression='current_stage <= :cs AND (attribute_not_exists(event_version) OR event_version < :v)',
+            ExpressionAttributeValues={
+                ':cs': deal['current']['stage_id'],
+                ':s': deal['current']['status'],
+                ':v': event_version(deal)
+            },
             ReturnValues="UPDATED_NEW"
         )
     except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise StaleDealEventError('Deal {} already has a later update'.format(deal['current']['id']))
         LOGGER.exception(error)
         exc_info = sys.exc_info()
         raise DynamoDBError(error).with_traceback(exc_info[2])
 
 
+def check_deal_order(item, deal):
+    '''Raise StaleDealEventError if the recorded deal is already at a later
+       stage or version than this event'''
+    current = deal['current']
+    if item['current_stage'] > current['stage_id']:
+        raise StaleDealEventError('Deal {} is already at stage {}'.format(current['id'], item['current_stage']))
+    if 'event_version' in item and item['event_version'] >= event_version(deal):
+        raise StaleDealEventError('Deal {} is already at version {}'.format(current['id'], item['event_version']))
+
+
 def get_deal_db(deal):
     '''Retrieves folder_ids dict for customer project from dynamodb'''
     table = DDB.Table('pipedrive-deals')
@@ -254,80 +387,44 @@ def get_deal_db(deal):
         raise Exception(errc).with_traceback(exc_info[2])
 
 
-def get_deal_fields(domain, token):
-    url = 'https://{}.pipedrive.com/v1/dealFields:(key,name,options)?start=0&api_token={}'.format(domain, token)
-
-    try:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        fields = resp.json()['data']
-    except Exception as error:
-        raise Exception(error)
-
-    return fields
-
-
 def get_deal_field(field_map, field_name, current):
-    gdrive_fields = ['GDriveLink', 'SOWLink', 'APNPortalOppLink']
-    for key in field_map.keys():
-        if field_map[key]['name'] == field_name:
-            if field_map[key]['name'] in gdrive_fields:
-                return current[key]
-            return field_map[key][current[key]]
+    '''Return the value of a mapped deal field, using option labels where they exist'''
+    return field_map.value(field_name, current)
 
 
 def build_field_map(fields, map_items):
-    field_map = {}
+    '''Index the option fields in map_items and the GDrive link fields'''
+    field_map = FieldIndex()
     gdrive_fields = ['GDrive Link', 'SOW Link', 'APN Portal Opp Link']
     for field in fields:
-        for item in map_items:
-            if item in field['name']:
-                field_map.update({field['key'] : {'name': field['name'].replace(' ', '')}})
-                for index in range(len(field['options'])):
-                    field_map[field['key']].update({'{}'.format(field['options'][index]['id']) : field['options'][index]['label']})
-        for item in gdrive_fields:
-            if item in field['name']:
-                field_map.update({field['key'] : {'name': field['name'].replace(' ', '')}})
+        name = field['name'].replace(' ', '')
+        if any(item in field['name'] for item in gdrive_fields):
+            field_map.add(field['key'], name)
+        elif any(item in field['name'] for item in map_items):
+            field_map.add(field['key'], name, field['options'] or [])
 
     return field_map
 
 
 def build_update_message(current, diff, field_map):
+    '''Construct the Updates payload, adding a readable entry for each mapped field'''
     msg = {}
     for key, value in diff.items():
         msg.update({key : value})
-        # if key in field_map.keys():
-        #     msg.update({field_map[key]['name'] : field_map[key]['{}'.format(value)]})
+        if key in field_map.names:
+            msg.update({field_map.names[key] : field_map.resolve(key, value)})
 
     return msg
 
 
-def fetch_api_token(credential_path):
-    ''' Fetch and return the PipeDrive API token '''
-    ssm = boto3.client('ssm')
-    parameter = ssm.get_parameter(Name=credential_path, WithDecryption=True)
-    return parameter['Parameter']['Value']
-
-
-def get_company_domain(api_token):
-    url = 'https://api.pipedrive.com/v1/users/me?api_token=' + api_token
-
+def get_pipedrive_credentials():
+    '''Retrieve Pipedrive credentials from the process-wide cache'''
     try:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        response = resp.json()['data']['company_domain']
-    except requests.exceptions.HTTPError as errh:
-        LOGGER.exception(errh)
-        raise ExternalAPIFailed() from errh
-    except requests.exceptions.RequestException as error:
-        LOGGER.exception(error)
-        raise Exception(error)
-
-    return response
+        token, domain = CREDENTIALS.get()
+    except WorthRetryingException as errw:
+        LOGGER.exception(errw)
+        raise
 
-def get_pipedrive_credentials():
-    token = fetch_api_token(API_TOKEN_PATH)
-    domain = get_company_domain(token)
     return token, domain
 
 
@@ -337,37 +434,135 @@ def format_response(message):
     return json.dumps(message)
 
 
-def lambda_handler(event, context):
-    '''Webhook function entry'''
-    response = {'statusCode': 200}
-
-    print('Event received: {}'.format(event))
+def process_deal(deal):
+    '''Run the pipedrive workflow for a single webhook payload, once per delivery'''
+    # Pipedrive redelivers webhooks; drop any we have already processed
+    key = delivery_key(deal)
+    if key is not None and not DELIVERIES.claim(key):
+        response = {'statusCode': 200}
+        response['body'] = format_response('Duplicate delivery of {}'.format(key))
+        return response
 
     try:
-        deal = json.loads(event['body'])
-        deal_event = deal['event']
-        stage = STAGE[deal['current']['stage_id']]
-        print(deal_event)
+        response = run_deal_workflow(deal)
+    except WorthRetryingException:
+        # Let the retry through the dedup check
+        if key is not None:
+            DELIVERIES.release(key)
+        raise
+
+    if key is not None:
+        DELIVERIES.complete(key)
+    return response
+
+
+def run_deal_workflow(deal):
+    '''Publish the SNS messages for a webhook payload and record the deal'''
+    response = {'statusCode': 200}
+    deal_event = deal['event']
+    stage = STAGE[deal['current']['stage_id']]
+    print(deal_event)
 
+    try:
         if deal_event == 'added.deal':
-            response = new_deal(deal, deal_event, 'lead_in', PIPEDRIVE_SNS_TOPIC_ARN)
-            put_deal_db(deal['current'])
-            if stage != 'lead_in':
-                for i in range(2, deal['current']['stage_id'] + 1):
-                    response = updated_deal(deal, deal_event, STAGE[i])
-                update_deal_db(deal)
+            # Record the deal first so a concurrent event for it cannot fan out twice
+            put_deal_db(deal['current'], event_version(deal))
+            try:
+                if stage == 'lead_in':
+                    response = new_deal(deal, deal_event, 'lead_in', PIPEDRIVE_SNS_TOPIC_ARN)
+                else:
+                    stages = [STAGE[i] for i in range(2, deal['current']['stage_id'] + 1)]
+                    response = catch_up_deal(deal, deal_event, stages)
+            except Exception:
+                # Nothing was published, so let a later event record the deal again
+                delete_deal_db(deal['current'], event_version(deal))
+                raise
 
         elif deal_event == 'updated.deal':
             if stage == 'lead_in':
                 response['body'] = format_response('No actions to perform in lead_in stage with updated.deal')
                 return response
-            if not get_deal_db(deal):
-                response = new_deal(deal, 'added.deal', 'lead_in', PIPEDRIVE_SNS_TOPIC_ARN)
-                put_deal_db(deal['current'])
-                for i in range(2, deal['current']['stage_id']):
-                    response = updated_deal(deal, deal_event, STAGE[i])
-            response = updated_deal(deal, deal_event, stage)
-            update_deal_db(deal)
+            item = get_deal_db(deal)
+            if not item:
+                put_deal_db(deal['current'], event_version(deal))
+                try:
+                    stages = [STAGE[i] for i in range(2, deal['current']['stage_id'] + 1)]
+                    response = catch_up_deal(deal, deal_event, stages)
+                except Exception:
+                    delete_deal_db(deal['current'], event_version(deal))
+                    raise
+            else:
+                check_deal_order(item, deal)
+                response = updated_deal(deal, deal_event, stage)
+                update_deal_db(deal)
+
+    except StaleDealEventError as errs:
+        # Out of order events are expected, drop them rather than retry
+        print('Dropping event: {}'.format(errs))
+        response = {'statusCode': 200}
+        response['body'] = format_response('Dropped out of order event: {}'.format(errs))
+
+    return response
+
+
+def validate_deal(deal):
+    '''Check a webhook payload has everything process_deal needs'''
+    try:
+        if deal['event'] not in ['added.deal', 'updated.deal']:
+            raise InvalidWebhookError('Unsupported event {}'.format(deal['event']))
+        if deal['current']['stage_id'] not in STAGE:
+            raise InvalidWebhookError('Unknown stage {}'.format(deal['current']['stage_id']))
+        if deal['current']['id'] is None:
+            raise InvalidWebhookError('Webhook payload has no deal id')
+        if deal['meta']['timestamp_micro'] is None:
+            raise InvalidWebhookError('Webhook payload has no timestamp')
+    except (KeyError, TypeError) as errk:
+        raise InvalidWebhookError('Webhook payload is missing {}'.format(errk))
+
+
+def enqueue_deal(deal):
+    '''Validate a webhook payload and queue it for queue_handler'''
+    validate_deal(deal)
+
+    params = {
+        'QueueUrl': WEBHOOK_QUEUE_URL,
+        'MessageBody': json.dumps(deal)
+    }
+    # A FIFO queue delivers each deal's events in order, one at a time,
+    # while different deals are still processed in parallel
+    if WEBHOOK_QUEUE_URL.endswith('.fifo'):
+        params['MessageGroupId'] = str(deal['current']['id'])
+        params['MessageDeduplicationId'] = hashlib.sha256(
+            (delivery_key(deal) or params['MessageBody']).encode()).hexdigest()
+
+    try:
+        resp = SQS.send_message(**params)
+    except ClientError as errc:
+        # Fail the request so Pipedrive delivers the webhook again
+        LOGGER.exception(errc)
+        response = {'statusCode': 503}
+        response['body'] = format_response('Unable to queue webhook: {}'.format(errc))
+        return response
+
+    response = {'statusCode': 200}
+    response['body'] = format_response('Queued as {}'.format(resp['MessageId']))
+    return response
+
+
+def lambda_handler(event, context):
+    '''Webhook function entry'''
+    response = {'statusCode': 200}
+
+    print('Event received: {}'.format(event))
+
+    try:
+        deal = json.loads(event['body'])
+
+        # With a queue configured, only acknowledge here and let queue_handler do the work
+        if WEBHOOK_QUEUE_URL:
+            response = enqueue_deal(deal)
+        else:
+            response = process_deal(deal)
 
     except Exception as error:
         if isinstance(error, WorthRetryingException):
@@ -386,3 +581,66 @@ def lambda_handler(event, context):
 
     finally:
         return response
+
+
+def queue_url(arn):
+    '''Build an SQS queue URL from the queue ARN'''
+    _, _, _, region, account, name = arn.split(':')
+    return 'https://sqs.{}.amazonaws.com/{}/{}'.format(region, account, name)
+
+
+def defer_record(record, delay):
+    '''Hide a record until the Pipedrive budget has refilled, rather than
+       letting the queue redeliver it straight away. Returns False when the
+       record could not be deferred'''
+    try:
+        SQS.change_message_visibility(
+            QueueUrl=queue_url(record['eventSourceARN']),
+            ReceiptHandle=record['receiptHandle'],
+            VisibilityTimeout=min(int(math.ceil(delay)), 43200)
+        )
+    except (ClientError, KeyError, ValueError) as error:
+        LOGGER.exception(error)
+        return False
+    return True
+
+
+def queue_handler(event, context):
+    '''Webhook queue consumer entry. Records that are worth retrying are
+       reported as batchItemFailures so only they are redelivered'''
+    failures = []
+    failed_groups = set()
+    undeferred = 0
+
+    print('Event received: {}'.format(event))
+
+    for record in event['Records']:
+        # Once a deal fails, hold back its later events so they stay in order
+        group = record.get('attributes', {}).get('MessageGroupId')
+        if group is not None and group in failed_groups:
+            failures.append({'itemIdentifier': record['messageId']})
+            continue
+
+        try:
+            response = process_deal(json.loads(record['body']))
+            print('Processed {}: {}'.format(record['messageId'], response))
+        except RateLimitExceeded as error:
+            LOGGER.warning('Deferring %s: %s', record['messageId'], error)
+            if not defer_record(record, error.retry_after):
+                undeferred += 1
+            failures.append({'itemIdentifier': record['messageId']})
+            if group is not None:
+                failed_groups.add(group)
+        except WorthRetryingException as error:
+            LOGGER.exception(error)
+            failures.append({'itemIdentifier': record['messageId']})
+            if group is not None:
+                failed_groups.add(group)
+        except Exception as error:
+            # Not worth retrying, the same as a 202 from lambda_handler
+            LOGGER.exception(error)
+
+    if undeferred:
+        # Redelivered straight away, so the rate limit will likely be hit again
+        LOGGER.error('Could not defer %d rate limited record(s)', undeferred)
+    return {'batchItemFailures': failures}
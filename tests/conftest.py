@@ -0,0 +1,175 @@
+'''Put each component directory on sys.path, the same way Lambda sees it,
+   and provide the fakes shared by the unit tests'''
+import os
+import re
+import sys
+import threading
+
+# moto has to register its botocore hooks before any component creates
+# its module-level clients, otherwise those clients talk to real AWS
+import moto  # pylint: disable=unused-import
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+COMPONENTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Components')
+
+for component in ['pipedrive', 'gdrive']:
+    sys.path.insert(0, os.path.abspath(os.path.join(COMPONENTS_DIR, component)))
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+QUOTED = r"'((?:\\.|[^'\\])*)'"
+
+
+class FakeClock:
+    '''Manually advanced clock. sleep() moves it forward and is recorded'''
+
+    def __init__(self):
+        self.now = 0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def unquote(value):
+    '''Undo escape_query_value'''
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def matches(item, q):
+    '''Whether a file matches the parts of a v2 q the gdrive functions use:
+       parent clauses (any of them), title, mimeType and trashed'''
+    parents = [unquote(parent) for parent in re.findall(QUOTED + ' in parents', q)]
+    if parents and not any(parent['id'] in parents for parent in item['parents']):
+        return False
+    title = re.search('title = ' + QUOTED, q)
+    if title and item['title'] != unquote(title.group(1)):
+        return False
+    for (operator, mime_type) in re.findall('mimeType (!?=) ' + QUOTED, q):
+        if (item['mimeType'] == unquote(mime_type)) != (operator == '='):
+            return False
+    return not ('trashed=false' in q and item['labels']['trashed'])
+
+
+class FakeRequest:
+    '''Drive request, run and recorded by execute() or by a batch'''
+
+    def __init__(self, drive, method, kwargs, run):
+        self.drive = drive
+        self.method = method
+        self.kwargs = kwargs
+        self.run = run
+
+    def execute(self, http=None):
+        self.drive.calls.append((self.method, self.kwargs))
+        return self.run()
+
+
+class FakeBatch:
+    '''Batch running its requests in order, recorded as one batch call'''
+
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self, http=None):
+        self.drive.calls.append(('batch', {'size': len(self.requests)}))
+        self.drive.batches.append(len(self.requests))
+        for (request_id, request) in self.requests:
+            try:
+                response = request.run()
+            except HttpError as error:
+                self.callback(request_id, None, error)
+            else:
+                self.callback(request_id, response, None)
+
+
+class FakeDrive:
+    '''In-memory Drive answering the v2 calls the gdrive functions make
+       through drive.auth.service: files list, get and insert, batches and
+       Get_Http_Object. items maps ids to v2 file resources.
+
+       calls records (method, kwargs) of every request sent, a batch as one
+       call, and batches the size of each batch. Listings return at most
+       page_size items per page when it is set'''
+
+    def __init__(self):
+        self.auth = self
+        self.service = self
+        self.items = {}
+        self.page_size = None
+        self.calls = []
+        self.batches = []
+        self.https = []
+        self._lock = threading.Lock()
+
+    def add(self, file_id, title, *parents, mime_type=FOLDER_MIME_TYPE, trashed=False, **fields):
+        '''Store a file and return its resource'''
+        item = dict(fields, id=file_id, title=title, mimeType=mime_type,
+                    parents=[{'id': parent} for parent in parents],
+                    alternateLink='https://drive.google.com/{}'.format(file_id),
+                    labels={'trashed': trashed})
+        self.items[file_id] = item
+        return item
+
+    def methods(self):
+        '''Names of the calls made so far'''
+        return [method for (method, _) in self.calls]
+
+    def files(self):
+        return self
+
+    def list(self, **kwargs):
+        def run():
+            found = [dict(item) for item in self.items.values() if matches(item, kwargs.get('q', ''))]
+            start = int(kwargs.get('pageToken') or 0)
+            size = min(size for size in (kwargs.get('maxResults'), self.page_size, len(found) or 1) if size)
+            page = {'items': found[start:start + size]}
+            if start + size < len(found):
+                page['nextPageToken'] = str(start + size)
+            return page
+        return FakeRequest(self, 'list', kwargs, run)
+
+    def get(self, **kwargs):
+        def run():
+            if kwargs['fileId'] not in self.items:
+                raise HttpError(httplib2.Response({'status': 404}), b'File not found', uri=kwargs['fileId'])
+            return dict(self.items[kwargs['fileId']])
+        return FakeRequest(self, 'get', kwargs, run)
+
+    def insert(self, **kwargs):
+        def run():
+            body = kwargs['body']
+            return dict(self.add('id{}'.format(len(self.items)), body['title'],
+                                 *[parent['id'] for parent in body.get('parents', [])],
+                                 mime_type=body.get('mimeType')))
+        return FakeRequest(self, 'insert', kwargs, run)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def Get_Http_Object(self):
+        with self._lock:
+            self.https.append(object())
+            return self.https[-1]
+
+
+@pytest.fixture()
+def clock():
+    '''Manually advanced clock'''
+    return FakeClock()
+
+
+@pytest.fixture()
+def drive():
+    '''Empty in-memory Drive'''
+    return FakeDrive()
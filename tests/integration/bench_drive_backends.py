@@ -0,0 +1,127 @@
+'''Compare the pydrive and REST Drive backends against a real Drive folder.
+
+   Cold start runs in a fresh interpreter per sample and times what a
+   function's cold start pays: importing drive_auth and the handler module
+   with DRIVE_BACKEND set, authorization and the first call. Per-call latency
+   then times the calls the gdrive functions make on one warm client.
+
+   Run from Components/gdrive with the service account key in place:
+
+       python ../../tests/integration/bench_drive_backends.py --folder-id <id>
+'''
+# pylint: disable=wrong-import-position
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+BACKENDS = ('pydrive', 'rest')
+
+
+def cold_start(backend, handler, settings_file, folder_id):
+    '''Import, authorize and list folder_id once, returning seconds per step.
+       Runs in a fresh interpreter with DRIVE_BACKEND already set to backend'''
+    timings = {}
+    start = time.perf_counter()
+    import drive_auth
+    importlib.import_module(handler)
+    timings['import'] = time.perf_counter() - start
+    assert drive_auth.DRIVE_BACKEND == backend
+
+    import drive_query
+    start = time.perf_counter()
+    drive = drive_auth.load_client(settings_file)
+    drive.auth.credentials.get_access_token()
+    timings['authorize'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    drive_query.find_children(drive, folder_id, 'bench-drive-backends')
+    timings['first_call'] = time.perf_counter() - start
+    return timings
+
+
+def warm_calls(drive, folder_id):
+    '''One round of the calls the gdrive functions make, keyed by name'''
+    import drive_batch
+    import drive_query
+
+    children = [child for (child, _, _) in drive_query.iter_children(drive, folder_id, page_size=10)][:5]
+    return {
+        'list': lambda: list(drive_query.iter_children(drive, folder_id)),
+        'find': lambda: drive_query.find_children(drive, folder_id, 'bench-drive-backends'),
+        'get': lambda: drive.auth.service.files().get(fileId=folder_id, fields='id,alternateLink').execute(),
+        'properties': lambda: drive.auth.service.properties().list(fileId=children[0] if children else folder_id).execute(),
+        'batch_get': lambda: drive_batch.execute_batch(drive, [
+            drive.auth.service.files().get(fileId=child, fields='id,alternateLink') for child in children or [folder_id]
+        ])
+    }
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples) * 1000, 1),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+        'max_ms': round(samples[-1] * 1000, 1)
+    }
+
+
+def bench(backend, handler, settings_file, folder_id, cold_runs, iterations):
+    '''Cold start and per-call latency summaries for one backend'''
+    cold = {}
+    for _ in range(cold_runs):
+        output = subprocess.run(
+            [sys.executable, __file__, '--cold', backend, '--handler', handler,
+             '--settings', settings_file, '--folder-id', folder_id],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True,
+            env=dict(os.environ, DRIVE_BACKEND=backend)
+        ).stdout
+        for (step, seconds) in json.loads(output).items():
+            cold.setdefault(step, []).append(seconds)
+
+    import drive_auth
+    drive = drive_auth.authorize_rest(settings_file) if backend == 'rest' else drive_auth.authorize(settings_file)
+    calls = warm_calls(drive, folder_id)
+    warm = {name: [] for name in calls}
+    for _ in range(iterations):
+        for (name, call) in calls.items():
+            start = time.perf_counter()
+            call()
+            warm[name].append(time.perf_counter() - start)
+
+    return {
+        'cold_start': {step: summarize(samples) for (step, samples) in cold.items()},
+        'per_call': {name: summarize(samples) for (name, samples) in warm.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--folder-id', required=True, help='Drive folder to list and read')
+    parser.add_argument('--settings', default='settings.yaml', help='pydrive settings file')
+    parser.add_argument('--backend', choices=BACKENDS, action='append', help='backend to run, default both')
+    parser.add_argument('--handler', default='create_folders', help='function module whose imports are timed')
+    parser.add_argument('--cold-runs', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--cold', choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold:
+        print(json.dumps(cold_start(args.cold, args.handler, args.settings, args.folder_id)))
+        return
+
+    results = {
+        backend: bench(backend, args.handler, args.settings, args.folder_id, args.cold_runs, args.iterations)
+        for backend in args.backend or BACKENDS
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
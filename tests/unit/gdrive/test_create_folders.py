@@ -69,3 +69,22 @@ def test_create_folder(gdrive_client):
     assert file_object['title'] == 'pytest'
     file_object.Delete()
 
+
+def test_lambda_handler_dry_run(monkeypatch):
+    '''A dry run should describe the plan without creating or recording anything'''
+    monkeypatch.setattr(h, 'init_auth', lambda: object())
+    monkeypatch.setattr(h, 'check_child_folder_exists', lambda drive, parent, title: [])
+    def fail(*args, **kwargs):
+        raise AssertionError('dry run must not write')
+    for name in ('create_folder', 'apply_plan', 'update_customers_table', 'publish_sns_message'):
+        monkeypatch.setattr(h, name, fail)
+    monkeypatch.setattr(h, 'GDRIVE_DRY_RUN', True)
+
+    event = {'Records': [{'Sns': {
+        'Message': json.dumps({'CustomerName': 'Acme', 'ProjectName': 'Migration'}),
+        'MessageAttributes': {'action': {'Value': 'create_folders'}}
+    }}]}
+    r = h.lambda_handler(event, None)
+    assert r['status'] == 200
+    assert json.loads(r['body'])['message'].startswith('customer folder Acme to create')
+    assert '18 folder(s) to create in 3 batch call(s)' in r['body']
@@ -0,0 +1,105 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import boto3
+from moto import mock_dynamodb
+import pytest
+
+import doc_templates as h
+
+TABLE_NAME = 'gdrive-doc-templates'
+
+
+class CountingTable:
+    '''Table wrapper counting version reads and scans'''
+    def __init__(self, table):
+        self.table = table
+        self.gets = 0
+        self.scans = 0
+
+    def get_item(self, **kwargs):
+        self.gets += 1
+        return self.table.get_item(**kwargs)
+
+    def scan(self, **kwargs):
+        self.scans += 1
+        return self.table.scan(**kwargs)
+
+
+@pytest.fixture()
+def table():
+    '''Mocked gdrive-doc-templates table holding two stages'''
+    with mock_dynamodb():
+        boto3.client('dynamodb', region_name='us-east-1').create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[{'AttributeName': 'stage', 'KeyType': 'HASH'},
+                       {'AttributeName': 'tag', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'stage', 'AttributeType': 'S'},
+                                  {'AttributeName': 'tag', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        table = boto3.resource('dynamodb', region_name='us-east-1').Table(TABLE_NAME)
+        table.put_item(Item={'stage': 'lead_in', 'tag': 'RiskLog', 'title': 'Risk Log', 'id': 'risk'})
+        table.put_item(Item={'stage': 'deal_closure', 'tag': 'EngagementDataPoints', 'title': 'Data', 'id': 'data'})
+        yield table
+
+
+def test_get_scans_once_per_version(table):
+    '''Templates are reloaded only after the version item moves'''
+    cache = h.DocTemplateCache(TABLE_NAME, ttl=0)
+    cache.table = CountingTable(cache.table)
+
+    assert cache.get('lead_in') == {'RiskLog': 'risk'}
+    assert cache.get('deal_closure') == {'EngagementDataPoints': 'data'}
+    assert cache.get('lead_validation') == {}
+    assert cache.table.scans == 1
+
+    table.put_item(Item={'stage': 'lead_in', 'tag': 'RiskLog', 'title': 'Risk Log', 'id': 'risk-v2'})
+    assert cache.get('lead_in') == {'RiskLog': 'risk'}
+
+    assert h.bump_version(TABLE_NAME) == 1
+    assert cache.get('lead_in') == {'RiskLog': 'risk-v2'}
+    assert cache.get('lead_in') == {'RiskLog': 'risk-v2'}
+    assert cache.table.scans == 2
+    assert '_version' not in cache.templates
+
+
+def test_get_checks_version_once_per_ttl(table):
+    '''Within the TTL the version item is not read at all'''
+    now = [0]
+    cache = h.DocTemplateCache(TABLE_NAME, ttl=60, clock=lambda: now[0])
+    cache.table = CountingTable(cache.table)
+
+    assert cache.get('lead_in') == {'RiskLog': 'risk'}
+    table.put_item(Item={'stage': 'lead_in', 'tag': 'RiskLog', 'title': 'Risk Log', 'id': 'risk-v2'})
+    h.bump_version(TABLE_NAME)
+    now[0] = 59
+    assert cache.get('lead_in') == {'RiskLog': 'risk'}
+    assert (cache.table.gets, cache.table.scans) == (1, 1)
+
+    now[0] = 60
+    assert cache.get('lead_in') == {'RiskLog': 'risk-v2'}
+    assert (cache.table.gets, cache.table.scans) == (2, 2)
+
+
+def test_bump_version_counts(table):
+    '''Each bump should produce a new version'''
+    assert [h.bump_version(TABLE_NAME) for _ in range(3)] == [1, 2, 3]
+
+
+def test_sync_templates_writes_only_changes(table):
+    '''Unchanged rows are left alone, changed ones written, vanished ones deleted'''
+    h.bump_version(TABLE_NAME)
+    rows = [
+        {'stage': 'lead_in', 'tag': 'RiskLog', 'title': 'Risk Log', 'id': 'risk'},
+        {'stage': 'lead_in', 'tag': 'AccountPlan', 'title': 'Account Plan', 'id': 'plan'}
+    ]
+    assert h.sync_templates(rows, TABLE_NAME) == (1, 1)
+    assert h.sync_templates(rows, TABLE_NAME) == (0, 0)
+
+    items = table.scan()['Items']
+    assert sorted((i['stage'], i['tag'], i.get('id')) for i in items) == [
+        ('_version', '_version', None),
+        ('lead_in', 'AccountPlan', 'plan'),
+        ('lead_in', 'RiskLog', 'risk')
+    ]
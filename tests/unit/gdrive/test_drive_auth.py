@@ -0,0 +1,138 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import datetime
+import os
+import subprocess
+import sys
+
+import pytest
+from oauth2client.client import AccessTokenRefreshError
+from pydrive.settings import InvalidConfigError
+
+import drive_auth as h
+
+NOW = datetime.datetime(2020, 1, 1, 12, 0, 0)
+
+
+class FakeCredentials:
+    '''Service account credentials stand-in counting refreshes'''
+    def __init__(self, token_expiry, fail=False):
+        self.token_expiry = token_expiry
+        self.fail = fail
+        self.refreshes = 0
+
+    def refresh(self, http):
+        if self.fail:
+            raise AccessTokenRefreshError('invalid_grant')
+        self.refreshes += 1
+        self.token_expiry = NOW + datetime.timedelta(hours=1)
+
+
+class FakeDrive:
+    '''GoogleDrive stand-in'''
+    def __init__(self, credentials):
+        self.auth = self
+        self.credentials = credentials
+
+
+class FakeLoader:
+    '''authorize() stand-in counting how many clients it built'''
+    def __init__(self, token_expiry=NOW + datetime.timedelta(hours=1), fail=False):
+        self.token_expiry = token_expiry
+        self.fail = fail
+        self.loaded = []
+
+    def __call__(self, settings_file):
+        self.loaded.append(settings_file)
+        return FakeDrive(FakeCredentials(self.token_expiry, self.fail))
+
+
+def test_get_reuses_client():
+    '''Warm invocations should share one client per settings file'''
+    loader = FakeLoader()
+    factory = h.DriveClientFactory(refresh_window=300, loader=loader, clock=lambda: NOW)
+
+    drive = factory.get('settings.yaml')
+    assert factory.get('settings.yaml') is drive
+    assert factory.get('other.yaml') is not drive
+    assert loader.loaded == ['settings.yaml', 'other.yaml']
+    assert drive.credentials.refreshes == 0
+
+
+def test_get_refreshes_before_expiry():
+    '''A token inside the refresh window is refreshed in place'''
+    now = [NOW]
+    loader = FakeLoader()
+    factory = h.DriveClientFactory(refresh_window=300, loader=loader, clock=lambda: now[0])
+    drive = factory.get()
+
+    now[0] = NOW + datetime.timedelta(minutes=56)
+    assert factory.get() is drive
+    assert drive.credentials.refreshes == 1
+    assert loader.loaded == ['settings.yaml']
+
+
+def test_get_refreshes_unknown_expiry():
+    '''Credentials without an expiry have never fetched a token'''
+    factory = h.DriveClientFactory(loader=FakeLoader(token_expiry=None), clock=lambda: NOW)
+    assert factory.get().credentials.refreshes == 1
+
+
+def test_get_refresh_failure():
+    '''A failed refresh surfaces as the AuthError init_auth maps'''
+    factory = h.DriveClientFactory(loader=FakeLoader(token_expiry=None, fail=True), clock=lambda: NOW)
+    with pytest.raises(h.AuthError):
+        factory.get()
+
+
+def test_invalidate():
+    '''invalidate() should make the next get() authorize again'''
+    loader = FakeLoader()
+    factory = h.DriveClientFactory(loader=loader, clock=lambda: NOW)
+    drive = factory.get()
+    factory.invalidate()
+    assert factory.get() is not drive
+    assert loader.loaded == ['settings.yaml', 'settings.yaml']
+
+
+def test_authorize_rest_without_service_config(tmp_path):
+    '''The REST backend reports settings problems like pydrive does'''
+    settings_file = tmp_path / 'settings.yaml'
+    settings_file.write_text('client_config_backend: file\n')
+    with pytest.raises(InvalidConfigError):
+        h.authorize_rest(str(settings_file))
+    with pytest.raises(InvalidConfigError):
+        h.authorize_rest(str(tmp_path / 'missing.yaml'))
+
+
+# GoogleAuth's own settings loader never closes the file
+@pytest.mark.filterwarnings('ignore::ResourceWarning', 'ignore::pytest.PytestUnraisableExceptionWarning')
+def test_authorize_builds_service_offline(monkeypatch, tmp_path):
+    '''authorize() wires the credentials into pydrive without a discovery request'''
+    class Credentials:
+        def authorize(self, http):
+            self.http = http
+            return http
+    credentials = Credentials()
+    monkeypatch.setattr(h, 'load_credentials', lambda settings_file: credentials)
+    settings_file = tmp_path / 'settings.yaml'
+    settings_file.write_text(
+        'client_config_backend: service\n'
+        'service_config:\n'
+        '  client_service_email: bot@example.iam.gserviceaccount.com\n'
+        '  client_pkcs12_file_path: key.pem\n'
+    )
+
+    drive = h.authorize(str(settings_file))
+    assert drive.auth.credentials is credentials
+    assert drive.auth.http is credentials.http
+    assert drive.auth.service.files() is not None
+
+
+def test_import_leaves_pydrive_unloaded():
+    '''Only the pydrive backend should pay for pydrive and discovery imports'''
+    script = 'import sys, drive_auth; print(sorted({"pydrive.auth", "pydrive.drive", "googleapiclient.discovery"} & set(sys.modules)))'
+    output = subprocess.run([sys.executable, '-c', script], check=True, stdout=subprocess.PIPE,
+                            cwd=os.path.dirname(h.__file__), universal_newlines=True).stdout
+    assert output.strip() == '[]'
@@ -0,0 +1,39 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import pytest
+
+import drive_batch as h
+
+
+def get_requests(drive, count):
+    '''files.get requests for files f0 to f{count - 1}'''
+    return [drive.files().get(fileId='f{}'.format(i), fields='id') for i in range(count)]
+
+
+def test_execute_batch_keeps_order(drive):
+    '''Responses should come back in request order, split into batches of BATCH_SIZE'''
+    for i in range(150):
+        drive.add('f{}'.format(i), 'File {}'.format(i))
+    r = h.execute_batch(drive, get_requests(drive, 150))
+
+    assert [item['id'] for item in r] == ['f{}'.format(i) for i in range(150)]
+    assert drive.batches == [100, 50]
+
+
+def test_execute_batch_reports_failures(drive):
+    '''Every batch should run, then the failed calls should be raised together'''
+    for i in range(150):
+        if i % 60 != 1:
+            drive.add('f{}'.format(i), 'File {}'.format(i))
+
+    with pytest.raises(h.DriveBatchError) as excinfo:
+        h.execute_batch(drive, get_requests(drive, 150))
+    assert sorted(excinfo.value.errors) == [1, 61, 121]
+    assert drive.batches == [100, 50]
+
+
+def test_execute_batch_empty(drive):
+    '''No requests should mean no round trip'''
+    assert h.execute_batch(drive, []) == []
+    assert drive.batches == []
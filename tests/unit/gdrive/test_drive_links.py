@@ -0,0 +1,27 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import drive_links as h
+
+
+def test_get_uses_remembered_links(drive):
+    '''Links seen in earlier responses should not be fetched again'''
+    drive.add('customer', 'Acme')
+    cache = h.LinkCache(max_entries=2)
+    cache.remember({'id': 'sow', 'alternateLink': 'https://drive.google.com/sow'})
+    cache.remember({'id': 'untitled'})
+
+    assert cache.get(drive, 'sow') == 'https://drive.google.com/sow'
+    assert drive.calls == []
+
+    assert cache.get(drive, 'customer') == 'https://drive.google.com/customer'
+    assert cache.get(drive, 'customer') == 'https://drive.google.com/customer'
+    assert drive.calls == [('get', {'fileId': 'customer', 'fields': 'id,alternateLink'})]
+
+
+def test_remember_evicts_least_recent():
+    '''The cache should stay within max_entries'''
+    cache = h.LinkCache(max_entries=1)
+    cache.remember({'id': 'a', 'alternateLink': 'link-a'})
+    cache.remember({'id': 'b', 'alternateLink': 'link-b'})
+    assert list(cache._links) == ['b']
@@ -0,0 +1,62 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import threading
+import time
+
+import pytest
+
+import drive_pool as h
+
+
+def test_map_keeps_order(drive):
+    '''Results should match item order however the calls finish'''
+    pool = h.DrivePool(drive, max_workers=4)
+    r = pool.map(lambda i, http: time.sleep(0.01 * (5 - i)) or i * i, range(5))
+    assert r == [0, 1, 4, 9, 16]
+
+
+def test_map_raises_first_failure(drive):
+    '''The error of the first failed item should be raised as is'''
+    def call(i, http):
+        if i in (1, 3):
+            raise KeyError(i)
+        return i
+    pool = h.DrivePool(drive, max_workers=4)
+
+    with pytest.raises(KeyError) as excinfo:
+        pool.map(call, range(5))
+    assert excinfo.value.args == (1,)
+
+
+def test_map_deadline(drive):
+    '''A call running past its deadline should raise DriveCallTimeout'''
+    release = threading.Event()
+    pool = h.DrivePool(drive, max_workers=2, timeout=0.05)
+
+    with pytest.raises(h.DriveCallTimeout):
+        pool.map(lambda i, http: release.wait(1) if i else i, range(2))
+    release.set()
+
+
+def test_http_per_call(drive):
+    '''Concurrent calls each get their own Http, and later calls reuse them'''
+    pool = h.DrivePool(drive, max_workers=3)
+    barrier = threading.Barrier(3)
+
+    def call(i, http):
+        barrier.wait(1)
+        return http
+
+    first = pool.map(call, range(3))
+    assert len(set(map(id, first))) == 3
+    assert set(map(id, pool.map(call, range(3)))) == set(map(id, first))
+    assert len(drive.https) == 3
+
+
+def test_drive_pools_outlive_invocations(drive):
+    '''The same client should always get the same pool'''
+    pools = h.DrivePools(max_workers=2)
+    assert pools.get(drive) is pools.get(drive)
+    assert pools.get(type(drive)()) is not pools.get(drive)
+    assert pools.get(drive).max_workers == 2
@@ -0,0 +1,98 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import drive_query as h
+
+
+PDF = 'application/pdf'
+
+
+def test_list_children_groups_pages_by_parent(drive):
+    '''One paged query should cover every parent and group items by parent'''
+    drive.page_size = 2
+    drive.add('1', 'Deliverables', 'sales')
+    drive.add('2', 'SOW', 'sales')
+    drive.add('3', 'Onboarding', 'delivery', 'other')
+    r = h.list_children(drive, ['sales', 'delivery', 'engineering'], directory_only=True)
+
+    assert r == {
+        'sales': [{'id': '1', 'title': 'Deliverables'}, {'id': '2', 'title': 'SOW'}],
+        'delivery': [{'id': '3', 'title': 'Onboarding'}],
+        'engineering': []
+    }
+    assert drive.methods() == ['list', 'list']
+    assert drive.calls[0][1]['q'] == ("('sales' in parents or 'delivery' in parents or 'engineering' in parents) "
+                                      "and mimeType = 'application/vnd.google-apps.folder' and trashed=false")
+
+
+def test_list_children_splits_long_queries(drive):
+    '''Parents beyond PARENTS_PER_QUERY should go in another query'''
+    h.list_children(drive, [str(i) for i in range(h.PARENTS_PER_QUERY + 1)])
+
+    assert drive.methods() == ['list', 'list']
+    assert "mimeType != " in drive.calls[0][1]['q']
+
+
+def test_find_children_filters_server_side(drive):
+    '''The lookup should escape the title, ask for id,title only and read one page'''
+    drive.page_size = 1
+    drive.add('4', "Who's Who", 'delivery')
+    drive.add('5', "Who's Who", 'delivery')
+    r = h.find_children(drive, 'delivery', "Who's Who", directory_only=True)
+
+    assert r == [{'id': '4', 'title': "Who's Who"}]
+    assert drive.methods() == ['list']
+    assert drive.calls[0][1]['q'] == ("'delivery' in parents and title = 'Who\\'s Who' and trashed=false "
+                                      "and mimeType = 'application/vnd.google-apps.folder'")
+    assert drive.calls[0][1]['fields'] == 'items(id,title,alternateLink)'
+
+
+def test_iter_children_stops_early(drive):
+    '''Stopping at the first hit should not fetch the next page'''
+    drive.add('1', 'SOW', 'sales', mime_type=PDF)
+    drive.add('2', 'Risk Log', 'sales', mime_type=PDF)
+    children = h.iter_children(drive, 'sales', page_size=1)
+
+    assert next(children) == ('1', 'SOW', PDF)
+    assert drive.methods() == ['list']
+    assert drive.calls[0][1]['fields'] == 'nextPageToken,items(id,title,mimeType,alternateLink)'
+    assert drive.calls[0][1]['maxResults'] == 1
+
+
+def test_list_file_object_reads_every_page(drive):
+    '''list_file_object should still return every child, filtered server side'''
+    drive.page_size = 1
+    drive.add('1', 'SOW', 'sales', mime_type=PDF)
+    drive.add('2', 'Risk Log', 'sales', mime_type=PDF)
+    drive.add('3', 'Archive', 'sales')
+    r = h.list_file_object(drive, 'sales')
+
+    assert r == [{'id': '1', 'title': 'SOW'}, {'id': '2', 'title': 'Risk Log'}]
+    assert "mimeType != " in drive.calls[0][1]['q']
+
+
+def test_child_index_lists_each_folder_once(drive):
+    '''Lookups after the first, and of created files, should not query Drive'''
+    drive.add('1', 'Risk Log', 'sales', mime_type='application/vnd.google-apps.document')
+    index = h.ChildIndex(drive)
+
+    assert index.lookup('sales', 'Risk Log') == [{'id': '1', 'title': 'Risk Log'}]
+    assert index.lookup('sales', 'Account Plan') == []
+    index.add('sales', {'id': '2', 'title': 'Account Plan'})
+    assert index.lookup('sales', 'Account Plan') == [{'id': '2', 'title': 'Account Plan'}]
+
+    assert drive.methods() == ['list']
+    q = drive.calls[0][1]['q']
+    assert "'sales' in parents" in q and 'mimeType != ' in q
+
+
+def test_list_file_properties_projects_properties(drive):
+    '''Properties should come back with the listing instead of per file'''
+    drive.add('1', 'SOW', 'templates', mime_type=PDF,
+              properties=[{'key': 'tag', 'value': 'SOW', 'visibility': 'PRIVATE'}])
+    drive.add('2', 'Notes', 'templates', mime_type=PDF)
+    assert h.list_file_properties(drive, 'templates') == [
+        {'id': '1', 'title': 'SOW', 'properties': [{'key': 'tag', 'value': 'SOW', 'visibility': 'PRIVATE'}]},
+        {'id': '2', 'title': 'Notes', 'properties': []}
+    ]
+    assert drive.calls[0][1]['fields'] == 'nextPageToken,items(id,title,properties(key,value,visibility))'
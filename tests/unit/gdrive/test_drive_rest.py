@@ -0,0 +1,181 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import json
+
+import pytest
+from googleapiclient.errors import HttpError
+
+import drive_batch
+import drive_query
+import drive_rest as h
+
+
+class FakeCredentials:
+    '''oauth2client credentials stand-in counting refreshes'''
+    def __init__(self):
+        self.access_token = 'token-0'
+        self.access_token_expired = False
+        self.refreshes = 0
+
+    def refresh(self, http):
+        self.refreshes += 1
+        self.access_token = 'token-{}'.format(self.refreshes)
+
+
+class FakeResponse:
+    def __init__(self, status_code, content, content_type='application/json'):
+        self.status_code = status_code
+        self.content = content if isinstance(content, bytes) else json.dumps(content).encode('utf-8')
+        self.headers = {'Content-Type': content_type}
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class FakeSession:
+    '''requests.Session stand-in replaying canned responses'''
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs):
+        self.requests.append(dict(kwargs, method=method, url=url, headers=headers))
+        return self.responses.pop(0)
+
+
+def batch_response(boundary, parts):
+    '''multipart/mixed body answering (index, status, body) parts'''
+    lines = []
+    for (index, status, body) in parts:
+        lines += [
+            '--' + boundary,
+            'Content-Type: application/http',
+            'Content-ID: <response-x+{}>'.format(index),
+            '',
+            'HTTP/1.1 {} OK'.format(status),
+            'Content-Type: application/json; charset=UTF-8',
+            '',
+            json.dumps(body)
+        ]
+    lines.append('--{}--'.format(boundary))
+    return FakeResponse(200, '\r\n'.join(lines).encode('utf-8'), 'multipart/mixed; boundary=' + boundary)
+
+
+def test_find_children_translates_v2():
+    '''v2 queries, fields and responses should round trip through v3'''
+    session = FakeSession(FakeResponse(200, {'files': [
+        {'id': 'f1', 'name': "Title's", 'webViewLink': 'https://drive.google.com/f1'}
+    ]}))
+    drive = h.RestDrive(FakeCredentials(), session=session)
+
+    assert drive_query.find_children(drive, 'root', "Title's") == [{'id': 'f1', 'title': "Title's"}]
+    request = session.requests[0]
+    assert request['url'] == 'https://www.googleapis.com/drive/v3/files'
+    assert request['headers']['Authorization'] == 'Bearer token-0'
+    assert request['params']['q'] == "'root' in parents and name = 'Title\\'s' and trashed=false"
+    assert request['params']['fields'] == 'files(id,name,webViewLink)'
+    assert request['params']['pageSize'] == drive_query.FIND_PAGE_SIZE
+
+
+def test_v3_query_leaves_literals():
+    '''Only the field name is renamed, never a quoted value'''
+    assert h.v3_query("title = 'title = x' and 'p' in parents") == "name = 'title = x' and 'p' in parents"
+
+
+def test_list_parents_and_labels():
+    '''parents and trashed come back in their v2 shapes'''
+    assert h.v3_fields('nextPageToken,items(id,title,alternateLink,parents(id))') == \
+        'nextPageToken,files(id,name,webViewLink,parents)'
+    assert h.to_v2({'id': 'a', 'parents': ['p'], 'trashed': True}) == \
+        {'id': 'a', 'parents': [{'id': 'p'}], 'labels': {'trashed': True}}
+
+
+def test_copy_body():
+    '''Copies send a v3 body and return v2 names'''
+    session = FakeSession(FakeResponse(200, {'id': 'c1', 'webViewLink': 'link'}))
+    drive = h.RestDrive(FakeCredentials(), session=session)
+
+    result = drive.auth.service.files().copy(
+        fileId='src', body={'title': 'SOW', 'parents': [{'id': 'dest'}]}, fields='id,alternateLink').execute()
+
+    assert result == {'id': 'c1', 'alternateLink': 'link'}
+    assert session.requests[0]['url'] == 'https://www.googleapis.com/drive/v3/files/src/copy'
+    assert session.requests[0]['json'] == {'name': 'SOW', 'parents': ['dest']}
+    assert session.requests[0]['params'] == {'fields': 'id,webViewLink'}
+
+
+def test_properties():
+    '''v2 property lookups read properties and appProperties'''
+    resource = {'properties': {'stage': 'lead_in'}, 'appProperties': {'tag': 'sow'}}
+    session = FakeSession(FakeResponse(200, resource), FakeResponse(200, resource), FakeResponse(200, resource))
+    drive = h.RestDrive(FakeCredentials(), session=session)
+
+    assert drive.service.properties().list(fileId='f').execute()['items'] == [
+        {'key': 'stage', 'value': 'lead_in', 'visibility': 'PUBLIC'},
+        {'key': 'tag', 'value': 'sow', 'visibility': 'PRIVATE'}
+    ]
+    assert drive.service.properties().get(fileId='f', propertyKey='tag').execute()['value'] == 'sow'
+    with pytest.raises(HttpError) as error:
+        drive.service.properties().get(fileId='f', propertyKey='stage').execute()
+    assert error.value.resp.status == 404
+
+
+def test_error_status():
+    '''Errors surface as HttpError so 404 handling keeps working'''
+    session = FakeSession(FakeResponse(404, {'error': {'code': 404}}))
+    drive = h.RestDrive(FakeCredentials(), session=session)
+    with pytest.raises(HttpError) as error:
+        drive.service.files().get(fileId='gone').execute()
+    assert error.value.resp.status == 404
+
+
+def test_refresh_on_401():
+    '''A rejected token is refreshed and the call retried once'''
+    credentials = FakeCredentials()
+    session = FakeSession(FakeResponse(401, {}), FakeResponse(200, {'id': 'a'}))
+    drive = h.RestDrive(credentials, session=session)
+
+    assert drive.service.files().get(fileId='a', fields='id').execute() == {'id': 'a'}
+    assert credentials.refreshes == 1
+    assert [r['headers']['Authorization'] for r in session.requests] == ['Bearer token-0', 'Bearer token-1']
+
+
+def test_batch():
+    '''Batches go out as one multipart request and answer in order'''
+    session = FakeSession(batch_response('b', [
+        (1, 404, {'error': {'code': 404}}),
+        (0, 200, {'id': 'new', 'webViewLink': 'link'})
+    ]))
+    drive = h.RestDrive(FakeCredentials(), session=session)
+
+    with pytest.raises(drive_batch.DriveBatchError) as error:
+        drive_batch.execute_batch(drive, [
+            drive_batch.insert_folder_request(drive, 'root', '_SALES'),
+            drive.service.files().get(fileId='gone', fields='id')
+        ])
+    assert list(error.value.errors) == [1]
+    assert error.value.errors[1].resp.status == 404
+
+    request = session.requests[0]
+    assert request['url'] == h.DRIVE_BATCH_URL
+    payload = request['data'].decode('utf-8')
+    assert 'POST /drive/v3/files?fields=id%2CwebViewLink HTTP/1.1' in payload
+    assert '"name": "_SALES"' in payload
+    assert 'GET /drive/v3/files/gone?fields=id HTTP/1.1' in payload
+
+
+def test_batch_responses():
+    '''Successful batch parts are converted to v2'''
+    session = FakeSession(batch_response('b', [(0, 200, {'id': 'a', 'name': 'A'})]))
+    drive = h.RestDrive(FakeCredentials(), session=session)
+    assert drive_batch.execute_batch(drive, [drive.service.files().get(fileId='a')]) == [{'id': 'a', 'title': 'A'}]
+
+
+def test_list_properties_projection():
+    '''Listing properties maps v3 properties and appProperties to the v2 list'''
+    assert h.v3_fields('nextPageToken,items(id,title,properties(key,value,visibility))') == \
+        'nextPageToken,files(id,name,properties,appProperties)'
+    assert h.to_v2({'files': [{'id': 'a', 'name': 'A', 'appProperties': {'tag': 'SOW'}}]}) == {'items': [
+        {'id': 'a', 'title': 'A', 'properties': [{'key': 'tag', 'value': 'SOW', 'visibility': 'PRIVATE'}]}
+    ]}
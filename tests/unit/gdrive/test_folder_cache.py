@@ -0,0 +1,66 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import boto3
+from moto import mock_dynamodb
+import pytest
+
+import folder_cache as h
+
+TABLE_NAME = 'gdrive-customers'
+FOLDER_IDS = {
+    'CustomerFolderId': 'customer',
+    'SalesFolder': {'RootId': 'sales', 'ProjectId': 'sales-project', 'SubFolders': {'SOW': 'sow'}}
+}
+
+
+def add_folders(drive, missing=(), trashed=()):
+    '''Store the project's folders, less the missing ones, in the drive'''
+    for folder_id in ['customer', 'sales', 'sales-project', 'sow']:
+        if folder_id not in missing:
+            drive.add(folder_id, folder_id, trashed=folder_id in trashed)
+    return drive
+
+
+@pytest.fixture()
+def cache():
+    '''Folder id cache over a mocked gdrive-customers table holding one project'''
+    with mock_dynamodb():
+        boto3.client('dynamodb', region_name='us-east-1').create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[{'AttributeName': 'customer', 'KeyType': 'HASH'},
+                       {'AttributeName': 'project', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'customer', 'AttributeType': 'S'},
+                                  {'AttributeName': 'project', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        boto3.resource('dynamodb', region_name='us-east-1').Table(TABLE_NAME).put_item(
+            Item={'customer': 'Acme', 'project': 'Migration', 'folder_ids': FOLDER_IDS}
+        )
+        yield h.FolderIdCache(TABLE_NAME, max_entries=1)
+
+
+def test_resolve_reads_table_and_validates(cache, drive):
+    '''Stored ids should be checked with one batch and returned with their links'''
+    add_folders(drive)
+    folder_ids, links = cache.resolve(drive, 'Acme', 'Migration')
+
+    assert folder_ids == FOLDER_IDS
+    assert links['sow'] == 'https://drive.google.com/sow'
+    assert drive.batches == [4]
+    assert cache.resolve(drive, 'Unknown', 'Project') is None
+
+
+@pytest.mark.parametrize('missing,trashed', [(('sow',), ()), ((), ('sales',))])
+def test_resolve_rejects_stale_ids(cache, drive, missing, trashed):
+    '''A deleted or trashed folder should send the caller back to discovery'''
+    add_folders(drive, missing, trashed)
+    assert cache.resolve(drive, 'Acme', 'Migration') is None
+    assert ('Acme', 'Migration') not in cache._entries
+
+
+def test_remember_evicts_least_recent(cache):
+    '''The in-process cache should stay within max_entries'''
+    cache.remember('Acme', 'Migration', FOLDER_IDS)
+    cache.remember('Acme', 'Support', FOLDER_IDS)
+    assert list(cache._entries) == [('Acme', 'Support')]
@@ -0,0 +1,41 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import folder_layout as h
+
+
+LAYOUT = h.render_layout(h.CUSTOMER_LAYOUT, project='Migration')
+
+
+def test_plan_new_customer(drive):
+    '''An empty customer folder should need every folder, one batch per depth'''
+    plan = h.plan_layout(drive, 'customer', LAYOUT)
+
+    assert plan.creates == 18
+    assert plan.calls == 3
+    assert drive.methods() == ['list']
+
+    paths = h.apply_plan(drive, plan)
+    assert drive.methods() == ['list', 'batch', 'batch', 'batch']
+    sow = drive.items[paths[('_SALES', 'Project Name: Migration', 'SOW')]]
+    assert (sow['title'], sow['parents']) == ('SOW', [{'id': paths[('_SALES', 'Project Name: Migration')]}])
+
+
+def test_plan_empty_root_lists_nothing(drive):
+    '''A root known to be empty should be planned without any listing'''
+    plan = h.plan_layout(drive, 'customer', LAYOUT, root_empty=True)
+
+    assert (plan.creates, plan.calls) == (18, 3)
+    assert drive.methods() == []
+
+
+def test_plan_only_missing_folders(drive):
+    '''Folders already in Drive should be reused and only the gaps created'''
+    h.apply_plan(drive, h.plan_layout(drive, 'customer', LAYOUT))
+    sow = [folder_id for (folder_id, item) in drive.items.items() if item['title'] == 'SOW'][0]
+    del drive.items[sow]
+    drive.calls = []
+
+    plan = h.plan_layout(drive, 'customer', LAYOUT)
+    assert plan.describe() == "1 folder(s) to create in 1 batch call(s): ['_SALES/Project Name: Migration/SOW']"
+    assert drive.methods() == ['list', 'list', 'list']
@@ -0,0 +1,92 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import pytest
+import requests
+
+import Components.pipedrive.credentials as h
+from errors import ExternalAPIFailed
+
+API_TOKEN_PATH = '/pipedrive/labs/pipedrive_api_token'
+
+
+@pytest.fixture()
+def loads():
+    '''Record of every credential load'''
+    return []
+
+
+@pytest.fixture()
+def provider(clock, loads):
+    '''Credential provider with a fake loader'''
+    def loader(credential_path):
+        loads.append(credential_path)
+        return 'token{}'.format(len(loads)), 'stelligent'
+    return h.CredentialProvider(API_TOKEN_PATH, ttl=100, refresh_window=10, loader=loader, clock=clock)
+
+
+def test_get_is_cached(provider, loads):
+    '''Warm invocations should reuse the cached token and domain'''
+    assert provider.get() == ('token1', 'stelligent')
+    assert provider.get() == ('token1', 'stelligent')
+    assert loads == [API_TOKEN_PATH]
+
+
+def test_refreshes_inside_window(provider, clock, loads):
+    '''Inside the refresh window the pair is reloaded before it is returned'''
+    provider.get()
+    clock.now = 95
+    assert provider.get() == ('token2', 'stelligent')
+    assert provider.get() == ('token2', 'stelligent')
+    assert len(loads) == 2
+
+
+def test_failed_refresh_keeps_pair(clock):
+    '''A reload failing inside the window should not fail the caller'''
+    results = [('token1', 'stelligent')]
+    def loader(credential_path):
+        if not results:
+            raise ExternalAPIFailed('SSM unavailable')
+        return results.pop()
+    provider = h.CredentialProvider(API_TOKEN_PATH, ttl=100, refresh_window=10, loader=loader, clock=clock)
+
+    provider.get()
+    clock.now = 95
+    assert provider.get() == ('token1', 'stelligent')
+    clock.now = 100
+    with pytest.raises(ExternalAPIFailed):
+        provider.get()
+
+
+def test_reloads_after_expiry(provider, clock, loads):
+    '''An expired pair should be reloaded before it is returned'''
+    provider.get()
+    clock.now = 100
+    assert provider.get() == ('token2', 'stelligent')
+
+
+def test_invalidate_if_unauthorized(provider, loads):
+    '''Only a 401 from Pipedrive should drop the cached token'''
+    provider.get()
+
+    response = requests.models.Response()
+    response.status_code = 500
+    provider.invalidate_if_unauthorized(requests.exceptions.HTTPError(response=response))
+    assert provider.get() == ('token1', 'stelligent')
+
+    response.status_code = 401
+    provider.invalidate_if_unauthorized(requests.exceptions.HTTPError(response=response))
+    assert provider.get() == ('token2', 'stelligent')
+
+
+def test_invalidate_if_unauthorized_cause(provider):
+    '''A 401 wrapped by the Pipedrive client should also drop the cached token'''
+    provider.get()
+
+    response = requests.models.Response()
+    response.status_code = 401
+    try:
+        raise ExternalAPIFailed('Unauthorized') from requests.exceptions.HTTPError(response=response)
+    except ExternalAPIFailed as error:
+        provider.invalidate_if_unauthorized(error)
+    assert provider.get() == ('token2', 'stelligent')
@@ -0,0 +1,90 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import pytest
+
+import Components.pipedrive.deal_fields as h
+
+FIELDS = [
+    {'key': 'abc123', 'name': 'Territory', 'options': [{'id': 9, 'label': 'US East'}]},
+    {'key': 'def456', 'name': 'GDrive Link', 'options': None}
+]
+
+
+@pytest.fixture()
+def calls():
+    '''Record of every dealFields fetch'''
+    return []
+
+
+@pytest.fixture()
+def cache(clock, calls):
+    '''Deal fields cache with a fake fetch'''
+    def fetch(domain, token):
+        calls.append((domain, token))
+        return FIELDS
+    return h.DealFieldsCache(ttl=60, fetch=fetch, clock=clock)
+
+
+def test_get_is_cached_until_ttl(cache, clock, calls):
+    '''Warm lookups should not refetch until the TTL expires'''
+    assert cache.get('stelligent', 'token') == FIELDS
+    cache.get('stelligent', 'token')
+    assert len(calls) == 1
+
+    clock.now = 61
+    cache.get('stelligent', 'token')
+    assert len(calls) == 2
+    assert cache.version == 2
+
+
+def test_derive_rebuilds_with_schema(cache, clock):
+    '''Derived values should only be rebuilt when the schema is refetched'''
+    builds = []
+    def builder(fields):
+        builds.append(fields)
+        return {f['key']: f['name'] for f in fields}
+
+    r = cache.derive('names', builder, 'stelligent', 'token')
+    assert r == {'abc123': 'Territory', 'def456': 'GDrive Link'}
+    cache.derive('names', builder, 'stelligent', 'token')
+    assert len(builds) == 1
+
+    cache.invalidate()
+    cache.derive('names', builder, 'stelligent', 'token')
+    assert len(builds) == 2
+
+
+def test_refetch_missing_once(cache, clock, calls):
+    '''Names without a deal field refetch at most once per schema'''
+    cache.min_age = 10
+    for _ in range(3):
+        cache.get('stelligent', 'token')
+        assert not cache.refetch_missing(['KickOffNotesLink'], 'stelligent', 'token')
+    assert len(calls) == 1
+
+    clock.now = 20
+    assert not cache.refetch_missing(['KickOffNotesLink'], 'stelligent', 'token')
+    assert cache.refetch_missing(['KickOffNotesLink', 'SOWLink'], 'stelligent', 'token')
+    assert not cache.refetch_missing(['SOWLink'], 'stelligent', 'token')
+    assert len(calls) == 2
+
+    clock.now = 81
+    cache.get('stelligent', 'token')
+    clock.now = 91
+    assert cache.refetch_missing(['SOWLink'], 'stelligent', 'token')
+    assert len(calls) == 4
+
+
+def test_domain_change_refetches(cache, calls):
+    '''A different company domain should never be served another's schema'''
+    cache.get('stelligent', 'token')
+    cache.get('stelligent-labs', 'token')
+    assert calls == [('stelligent', 'token'), ('stelligent-labs', 'token')]
+
+
+def test_index_fields():
+    '''Field names should be indexed with their spaces removed'''
+    r = h.index_fields(FIELDS)
+    assert r.keys == {'Territory': 'abc123', 'GDriveLink': 'def456'}
+    assert r.value('GDriveLink', {'def456': 'https://drive.google.com'}) == 'https://drive.google.com'
@@ -10,6 +10,9 @@ from moto import mock_sns, mock_sts
 import pytest
 
 import Components.slack.create_channel as h
+import Components.pipedrive.deal_update as deal_update
+from deal_fields import DealFieldsCache
+from rate_limit import RateLimitExceeded
 
 EVENT_FILE = os.path.join(
     os.path.dirname(__file__),
@@ -20,3 +23,100 @@ EVENT_FILE = os.path.join(
 )
 
 SNS_TOPIC_NAME = "mock-pipedrive-component-topic"
+
+
+def test_changed_deal_fields():
+    '''Only fields whose value differs from the deal should be sent'''
+    deal = {'key1': 'https://drive.google.com/a', 'key2': None}
+    fields = {
+        'GDriveLink': {'key1': 'https://drive.google.com/a'},
+        'SOWLink': {'key2': 'https://drive.google.com/b'},
+        'APNPortalOppLink': {'key3': 'https://drive.google.com/c'}
+    }
+    assert deal_update.changed_deal_fields(deal, fields) == {
+        'key2': 'https://drive.google.com/b',
+        'key3': 'https://drive.google.com/c'
+    }
+
+
+def test_get_deal_fields_skips_unknown_links(monkeypatch):
+    '''Link names with no deal field should not refetch the schema every call'''
+    fetches = []
+    def fetch(domain, token):
+        fetches.append(domain)
+        return [{'key': 'key2', 'name': 'SOW Link', 'options': None}]
+    monkeypatch.setattr(deal_update, 'DEAL_FIELDS', DealFieldsCache(fetch=fetch))
+
+    for _ in range(3):
+        fields = deal_update.get_deal_fields('stelligent', 'token', {'SOWLink': 'b', 'KickOffNotesLink': 'k'})
+        assert fields == {'SOWLink': {'key2': 'b'}}
+    assert fetches == ['stelligent']
+
+
+@mock_sns
+def test_lambda_handler_single_put(monkeypatch):
+    '''All changed link fields should go to Pipedrive in one PUT'''
+    sns = boto3.client('sns')
+    topic_arn = sns.create_topic(Name=SNS_TOPIC_NAME)['TopicArn']
+    monkeypatch.setattr(deal_update, 'PIPEDRIVE_SNS_TOPIC_ARN', topic_arn)
+    monkeypatch.setattr(deal_update, 'get_pipedrive_credentials', lambda: ('token', 'stelligent'))
+    monkeypatch.setattr(deal_update, 'get_deal_fields', lambda domain, token, fields: {
+        'GDriveLink': {'key1': 'a'},
+        'SOWLink': {'key2': 'b'}
+    })
+    monkeypatch.setattr(deal_update, 'get_deal', lambda domain, token, deal_id: {'key1': 'a'})
+    puts = []
+    monkeypatch.setattr(deal_update, 'update_deal_fields',
+                        lambda domain, token, deal_id, data: puts.append((deal_id, data)))
+
+    event = {'Records': [{'Sns': {
+        'Message': json.dumps({'CustomerName': 'c', 'ProjectName': 'p', 'DealId': 45,
+                               'DealFieldLinks': {'GDriveLink': 'a', 'SOWLink': 'b'}}),
+        'MessageAttributes': {'stage': {'Value': 'lead_in'}, 'action': {'Value': 'create_folders'}}
+    }}]}
+    r = deal_update.lambda_handler(event, None)
+    assert r['statusCode'] == 200
+    assert puts == [(45, {'key2': 'b'})]
+
+
+@mock_sns
+def test_lambda_handler_single_field_skips_get(monkeypatch):
+    '''A single link field should be PUT without reading the deal first'''
+    sns = boto3.client('sns')
+    topic_arn = sns.create_topic(Name=SNS_TOPIC_NAME)['TopicArn']
+    monkeypatch.setattr(deal_update, 'PIPEDRIVE_SNS_TOPIC_ARN', topic_arn)
+    monkeypatch.setattr(deal_update, 'get_pipedrive_credentials', lambda: ('token', 'stelligent'))
+    monkeypatch.setattr(deal_update, 'get_deal_fields', lambda domain, token, fields: {
+        'SOWLink': {'key2': 'b'}
+    })
+    def get_deal(domain, token, deal_id):
+        raise AssertionError('deal should not be read')
+    monkeypatch.setattr(deal_update, 'get_deal', get_deal)
+    puts = []
+    monkeypatch.setattr(deal_update, 'update_deal_fields',
+                        lambda domain, token, deal_id, data: puts.append((deal_id, data)))
+
+    event = {'Records': [{'Sns': {
+        'Message': json.dumps({'CustomerName': 'c', 'ProjectName': 'p', 'DealId': 45,
+                               'CopiedFileLinks': {'SOWLink': 'b'}}),
+        'MessageAttributes': {'stage': {'Value': 'lead_in'}, 'action': {'Value': 'copy_files'}}
+    }}]}
+    r = deal_update.lambda_handler(event, None)
+    assert r['statusCode'] == 200
+    assert puts == [(45, {'key2': 'b'})]
+
+
+def test_lambda_handler_raises_rate_limited(monkeypatch):
+    '''A rate limited update should fail the invocation so Lambda retries it'''
+    monkeypatch.setattr(deal_update, 'get_pipedrive_credentials', lambda: ('token', 'stelligent'))
+    def get_deal_fields(domain, token, fields):
+        raise RateLimitExceeded('Pipedrive rate limit reached', 2.5)
+    monkeypatch.setattr(deal_update, 'get_deal_fields', get_deal_fields)
+
+    event = {'Records': [{'Sns': {
+        'Message': json.dumps({'CustomerName': 'c', 'ProjectName': 'p', 'DealId': 45,
+                               'CopiedFileLinks': {'SOWLink': 'b'}}),
+        'MessageAttributes': {'stage': {'Value': 'lead_in'}, 'action': {'Value': 'copy_files'}}
+    }}]}
+    with pytest.raises(RateLimitExceeded):
+        deal_update.lambda_handler(event, None)
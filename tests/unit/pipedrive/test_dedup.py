@@ -0,0 +1,89 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import json
+import os
+
+import boto3
+from moto import mock_dynamodb
+import pytest
+
+import Components.pipedrive.dedup as h
+
+UPDATE_EVENT_FILE = os.path.join(
+    os.path.dirname(__file__),
+    '..',
+    '..',
+    'events',
+    'update_deal_apigw.json'
+)
+
+TABLE_NAME = 'pipedrive-webhook-events'
+
+
+@pytest.fixture()
+def update_event(event_file=UPDATE_EVENT_FILE):
+    '''Trigger event'''
+    with open(event_file) as f:
+        return json.load(f)
+
+
+@pytest.fixture()
+def store():
+    '''Delivery store backed by a mocked table'''
+    with mock_dynamodb():
+        boto3.client('dynamodb', region_name='us-east-1').create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[{'AttributeName': 'event_key', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'event_key', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield h.DeliveryStore(TABLE_NAME, ttl=60, lease=30)
+
+
+def test_delivery_key(update_event):
+    '''The key should combine event, meta id and event timestamp'''
+    deal = update_event['body']
+    assert h.delivery_key(deal) == 'updated.deal:45:1569519879391503'
+    assert h.delivery_key({'event': 'updated.deal'}) is None
+
+    # A second update in the same second is a new delivery, a retry is not
+    redelivery = dict(deal, retry=1)
+    same_second = dict(deal, meta=dict(deal['meta'], timestamp_micro=deal['meta']['timestamp_micro'] + 1))
+    assert h.delivery_key(redelivery) == h.delivery_key(deal)
+    assert h.delivery_key(same_second) != h.delivery_key(deal)
+
+
+def test_claim_drops_redelivery(store):
+    '''Only the first delivery of a key should be claimed'''
+    assert store.claim('updated.deal:45:2019-09-26 17:44:39')
+    assert not store.claim('updated.deal:45:2019-09-26 17:44:39')
+    assert store.claim('updated.deal:45:2019-09-26 17:50:00')
+    assert store.hit_rate == pytest.approx(1 / 3)
+
+
+def test_release_and_expiry(store):
+    '''Released or expired deliveries should be claimable again'''
+    assert store.claim('added.deal:33:2019-09-18 13:55:03')
+    store.release('added.deal:33:2019-09-18 13:55:03')
+    assert store.claim('added.deal:33:2019-09-18 13:55:03')
+
+    now = store.clock()
+    store.clock = lambda: now + 61
+    assert store.claim('added.deal:33:2019-09-18 13:55:03')
+
+
+def test_lease_until_complete(store):
+    '''An unfinished delivery is dropped only while its lease lasts'''
+    now = store.clock()
+    assert store.claim('updated.deal:45:1')
+    store.clock = lambda: now + 29
+    assert not store.claim('updated.deal:45:1')
+    store.clock = lambda: now + 31
+    assert store.claim('updated.deal:45:1')
+
+    store.complete('updated.deal:45:1')
+    store.clock = lambda: now + 90
+    assert not store.claim('updated.deal:45:1')
+    store.clock = lambda: now + 92
+    assert store.claim('updated.deal:45:1')
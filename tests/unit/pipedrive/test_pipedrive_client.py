@@ -0,0 +1,95 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import pytest
+import requests
+
+import pipedrive_client as h
+from errors import ExternalAPIFailed, PipedriveRequestError
+
+URL = 'https://stelligent.pipedrive.com/v1/deals/45?api_token=token'
+
+
+class FakeSession:
+    '''Session that replays a list of responses or exceptions'''
+    def __init__(self, results):
+        self.results = list(results)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def response(status_code, headers=None):
+    '''Build a requests response with the given status'''
+    resp = requests.models.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers or {})
+    resp.url = URL
+    return resp
+
+
+@pytest.fixture()
+def sleeps():
+    '''Record of every backoff delay'''
+    return []
+
+
+def client(results, sleeps):
+    '''Client with a fake session and no real sleeping'''
+    return h.PipedriveClient(retries=3, session=FakeSession(results), sleep=sleeps.append)
+
+
+def test_retries_throttling_and_server_errors(sleeps):
+    '''429 and 5xx responses should be retried with backoff, honouring Retry-After'''
+    c = client([response(429, {'Retry-After': '2'}), response(502), response(200)], sleeps)
+    r = c.get(URL)
+
+    assert r.status_code == 200
+    assert len(c.session.calls) == 3
+    assert sleeps[0] >= 2
+    assert c.session.calls[0][2]['timeout'] == c.timeout
+
+
+def test_maps_http_errors(sleeps):
+    '''Client errors are not retried and keep their response for callers'''
+    c = client([response(401)], sleeps)
+    with pytest.raises(ExternalAPIFailed) as e:
+        c.put(URL, data={'title': 'Testing'})
+
+    assert e.value.__cause__.response.status_code == 401
+    assert not sleeps
+
+
+def test_maps_connection_errors(sleeps):
+    '''Connection failures are retried, then raised as PipedriveRequestError'''
+    c = client([requests.exceptions.ConnectionError()] * 4, sleeps)
+    with pytest.raises(PipedriveRequestError):
+        c.get(URL)
+
+    assert len(sleeps) == 3
+
+
+def test_stops_retrying_at_deadline(sleeps):
+    '''Retries stop once another attempt would not fit in the deadline'''
+    now = [0]
+    def sleep(delay):
+        sleeps.append(delay)
+        now[0] += delay
+    def request(method, url, **kwargs):
+        session.calls.append((method, url, kwargs))
+        now[0] += 7
+        raise requests.exceptions.ReadTimeout()
+    session = FakeSession([])
+    session.request = request
+    c = h.PipedriveClient(timeout=(3, 10), retries=3, session=session, sleep=sleep,
+                          deadline=15, clock=lambda: now[0], backoff=0)
+
+    with pytest.raises(PipedriveRequestError):
+        c.get(URL)
+    assert len(session.calls) == 2
+    assert [call[2]['timeout'] for call in session.calls] == [(3, 10), (3, 8)]
@@ -0,0 +1,60 @@
+# pylint: disable=protected-access
+# pylint: disable=wrong-import-position
+# pylint: disable=redefined-outer-name
+import boto3
+from moto import mock_dynamodb
+import pytest
+
+import rate_limit as h
+
+TABLE_NAME = 'pipedrive-rate-limit'
+
+
+@pytest.fixture()
+def bucket(clock):
+    '''Token bucket of 4 tokens per 2 seconds backed by a mocked table'''
+    with mock_dynamodb():
+        boto3.client('dynamodb', region_name='us-east-1').create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[{'AttributeName': 'bucket', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'bucket', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield h.TokenBucket(TABLE_NAME, capacity=4, window=2, max_wait=1, clock=clock, sleep=clock.sleep)
+
+
+def test_acquire_waits_for_refill(bucket, clock):
+    '''Once the bucket is empty, acquire should sleep until a token refills'''
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.slept == []
+
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.5)]
+
+
+def test_acquire_shares_budget(bucket, clock):
+    '''Two limiters on the same bucket should draw from one budget'''
+    other = h.TokenBucket(TABLE_NAME, capacity=4, window=2, max_wait=1, clock=clock, sleep=clock.sleep)
+    for _ in range(2):
+        bucket.acquire()
+        other.acquire()
+
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.5)]
+
+
+def test_observe_exhausted_defers(bucket, clock):
+    '''A zero X-RateLimit-Remaining should block until the server window resets'''
+    bucket.observe({'X-RateLimit-Limit': '4', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '2'})
+
+    with pytest.raises(h.RateLimitExceeded) as excinfo:
+        bucket.acquire()
+    assert excinfo.value.retry_after == pytest.approx(2.5)
+    assert clock.slept == []
+
+
+def test_observe_ignores_plenty(bucket):
+    '''Headers with budget to spare should not cost a write'''
+    bucket.observe({'X-RateLimit-Limit': '80', 'X-RateLimit-Remaining': '50'})
+    assert 'Item' not in bucket.table.get_item(Key={'bucket': 'pipedrive'})
@@ -6,10 +6,11 @@ import os
 import requests
 
 import boto3
-from moto import mock_sns, mock_sts
+from moto import mock_dynamodb, mock_sns, mock_sqs, mock_sts
 import pytest
 
 import Components.pipedrive.webhook as h
+from errors import ExternalAPIFailed
 
 NEW_EVENT_FILE = os.path.join(
     os.path.dirname(__file__),
@@ -65,3 +66,304 @@ def test_new_deal(sns_client, new_event, sns_topic_name=SNS_TOPIC_NAME):
     PIPEDRIVE_SNS_TOPIC_ARN = 'arn:aws:sns:us-east-1:123456789012:wrong-pipedrive-component-topic'
     with pytest.raises(Exception) as e:
         r = h.new_deal(deal, deal_event, 'lead_in', PIPEDRIVE_SNS_TOPIC_ARN)
+
+DEAL_FIELDS = [
+    {'key': 'dc7bdcb1ee2a839889b303855b568dbf23336126', 'name': 'Territory',
+     'options': [{'id': 9, 'label': 'US East'}, {'id': 10, 'label': 'US West'}]},
+    {'key': '5cd6ba521799605a921543753c559fcd23b3b70d', 'name': 'GDrive Link', 'options': None},
+    {'key': 'title', 'name': 'Title', 'options': None}
+]
+
+
+def test_build_field_map(update_event):
+    '''Mapped fields should resolve to option labels and link fields to raw values'''
+    current = update_event['body']['current']
+    field_map = h.build_field_map(DEAL_FIELDS, ['Territory', 'Solution Program', 'Deal Type'])
+
+    assert h.get_deal_field(field_map, 'Territory', current) == 'US East'
+    assert h.get_deal_field(field_map, 'GDriveLink', current) == current['5cd6ba521799605a921543753c559fcd23b3b70d']
+    assert h.get_deal_field(field_map, 'DealType', current) is None
+    assert 'title' not in field_map.names
+
+
+def test_build_update_message():
+    '''Updates should carry a readable label next to each changed mapped field'''
+    field_map = h.build_field_map(DEAL_FIELDS, ['Territory'])
+    diff = {'dc7bdcb1ee2a839889b303855b568dbf23336126': '10', 'stage_id': 3}
+
+    r = h.build_update_message({}, diff, field_map)
+    assert r == {
+        'dc7bdcb1ee2a839889b303855b568dbf23336126': '10',
+        'Territory': 'US West',
+        'stage_id': 3
+    }
+
+
+@pytest.fixture()
+def cached_fields(monkeypatch):
+    '''Serve credentials and deal fields without calling SSM or Pipedrive'''
+    monkeypatch.setattr(h, 'get_pipedrive_credentials', lambda: ('token', 'stelligent'))
+    monkeypatch.setattr(h.DEAL_FIELDS, 'fetch', lambda domain, token: DEAL_FIELDS)
+    h.DEAL_FIELDS.invalidate()
+    yield
+    h.DEAL_FIELDS.invalidate()
+
+
+@mock_sts
+@mock_sns
+def test_catch_up_deal(monkeypatch, sns_client, new_event, cached_fields):
+    '''A deal added straight into deal_closure should publish every stage in one batch'''
+    deal = new_event['body']
+    deal['current']['stage_id'] = 6
+    topic_arn = sns_client.create_topic(Name=SNS_TOPIC_NAME)['TopicArn']
+    monkeypatch.setattr(h, 'PIPEDRIVE_SNS_TOPIC_ARN', topic_arn)
+
+    calls = []
+    publish_batch = h.SNS.publish_batch
+    def record_publish_batch(**kwargs):
+        calls.append([entry['Id'] for entry in kwargs['PublishBatchRequestEntries']])
+        return publish_batch(**kwargs)
+    monkeypatch.setattr(h.SNS, 'publish_batch', record_publish_batch)
+
+    stages = [h.STAGE[i] for i in range(2, 7)]
+    r = h.catch_up_deal(deal, 'added.deal', stages)
+
+    assert r['statusCode'] == 200
+    assert calls == [['0-lead_in', '1-lead_validation', '2-solution_development',
+                      '3-proposal_development', '4-negotiation', '5-deal_closure']]
+    assert len(json.loads(r['body'])['message']['Successful']) == 6
+
+
+@mock_sts
+@mock_sns
+def test_publish_sns_batch_reports_failures(monkeypatch):
+    '''Messages rejected by SNS should be named in the raised error'''
+    def publish_batch(**kwargs):
+        return {
+            'Successful': [],
+            'Failed': [{'Id': entry['Id'], 'Code': 'InternalError', 'SenderFault': False}
+                       for entry in kwargs['PublishBatchRequestEntries']]
+        }
+    monkeypatch.setattr(h.SNS, 'publish_batch', publish_batch)
+
+    attributes = {'stage': {'DataType': 'String', 'StringValue': 'lead_in'}}
+    with pytest.raises(h.SnsPublishError) as e:
+        h.publish_sns_batch('arn:aws:sns:us-east-1:123456789012:topic', [({}, attributes)])
+    assert '0-lead_in' in str(e.value)
+
+
+@mock_sqs
+def test_lambda_handler_enqueues(monkeypatch, update_event):
+    '''With a queue configured the webhook should only be validated and queued'''
+    queue_url = boto3.client('sqs').create_queue(QueueName='pipedrive-webhook-queue')['QueueUrl']
+    monkeypatch.setattr(h, 'WEBHOOK_QUEUE_URL', queue_url)
+    monkeypatch.setattr(h, 'process_deal', lambda deal: pytest.fail('processed synchronously'))
+
+    r = h.lambda_handler({'body': json.dumps(update_event['body'])}, None)
+    assert r['statusCode'] == 200
+
+    messages = boto3.client('sqs').receive_message(QueueUrl=queue_url)['Messages']
+    assert json.loads(messages[0]['Body'])['current']['id'] == 45
+
+    update_event['body']['current']['stage_id'] = 9
+    r = h.lambda_handler({'body': json.dumps(update_event['body'])}, None)
+    assert r['statusCode'] == 202
+    assert 'InvalidWebhookError' in r['body']
+
+
+def test_queue_handler_reports_retryable_failures(monkeypatch):
+    '''Only records that are worth retrying should be reported back to SQS'''
+    def process_deal(deal):
+        if deal['id'] == 1:
+            raise ExternalAPIFailed('Pipedrive unavailable')
+        if deal['id'] == 2:
+            raise h.RegressiveStageUpdateError('Current stage is less than previous stage')
+        return {'statusCode': 200}
+    monkeypatch.setattr(h, 'process_deal', process_deal)
+
+    event = {'Records': [{'messageId': 'm{}'.format(i), 'body': json.dumps({'id': i})} for i in range(3)]}
+    r = h.queue_handler(event, None)
+    assert r == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+
+
+def test_queue_handler_holds_back_failed_deal(monkeypatch):
+    '''After a deal fails, its later events in the batch should wait for the retry'''
+    processed = []
+    def process_deal(deal):
+        if deal['id'] == 1:
+            raise ExternalAPIFailed('Pipedrive unavailable')
+        processed.append(deal['id'])
+    monkeypatch.setattr(h, 'process_deal', process_deal)
+
+    records = [(1, '45'), (2, '45'), (3, '46')]
+    event = {'Records': [{
+        'messageId': 'm{}'.format(i),
+        'body': json.dumps({'id': i}),
+        'attributes': {'MessageGroupId': group}
+    } for (i, group) in records]}
+    r = h.queue_handler(event, None)
+    assert r == {'batchItemFailures': [{'itemIdentifier': 'm1'}, {'itemIdentifier': 'm2'}]}
+    assert processed == [3]
+
+
+@mock_sqs
+def test_enqueue_deal_fifo(monkeypatch, update_event):
+    '''Webhooks sent to a FIFO queue should be grouped by deal id'''
+    sqs = boto3.client('sqs')
+    queue_url = sqs.create_queue(QueueName='pipedrive-webhook-queue.fifo',
+                                 Attributes={'FifoQueue': 'true'})['QueueUrl']
+    monkeypatch.setattr(h, 'WEBHOOK_QUEUE_URL', queue_url)
+
+    h.enqueue_deal(update_event['body'])
+    h.enqueue_deal(update_event['body'])
+
+    messages = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10,
+                                   AttributeNames=['MessageGroupId'])['Messages']
+    assert len(messages) == 1
+    assert messages[0]['Attributes']['MessageGroupId'] == '45'
+
+
+@pytest.fixture()
+def deals_table():
+    '''Mocked pipedrive-deals table'''
+    with mock_dynamodb():
+        boto3.client('dynamodb', region_name='us-east-1').create_table(
+            TableName='pipedrive-deals',
+            KeySchema=[{'AttributeName': 'customer', 'KeyType': 'HASH'},
+                       {'AttributeName': 'project', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[{'AttributeName': 'customer', 'AttributeType': 'S'},
+                                  {'AttributeName': 'project', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield
+
+
+def test_deal_db_drops_out_of_order_events(deals_table, update_event):
+    '''Writes for a deal already recorded at a later stage or version should be refused'''
+    deal = update_event['body']
+    h.put_deal_db(deal['current'], h.event_version(deal))
+    with pytest.raises(h.StaleDealEventError):
+        h.put_deal_db(deal['current'], h.event_version(deal))
+
+    with pytest.raises(h.StaleDealEventError):
+        h.update_deal_db(deal)
+    with pytest.raises(h.StaleDealEventError):
+        h.check_deal_order(h.get_deal_db(deal), deal)
+
+    deal['current']['stage_id'] = 3
+    deal['meta']['timestamp_micro'] += 1000000
+    h.check_deal_order(h.get_deal_db(deal), deal)
+    h.update_deal_db(deal)
+    assert h.get_deal_db(deal)['current_stage'] == 3
+
+    deal['current']['stage_id'] = 2
+    deal['meta']['timestamp_micro'] += 1000000
+    with pytest.raises(h.StaleDealEventError):
+        h.update_deal_db(deal)
+
+
+def test_deal_db_keeps_updates_in_the_same_second(deals_table, update_event):
+    '''Two updates sharing an update_time are both applied, in webhook order'''
+    deal = update_event['body']
+    h.put_deal_db(deal['current'], h.event_version(deal))
+
+    deal['current']['stage_id'] = 3
+    deal['meta']['timestamp_micro'] += 1
+    h.check_deal_order(h.get_deal_db(deal), deal)
+    h.update_deal_db(deal)
+
+    deal['current']['stage_id'] = 4
+    deal['meta']['timestamp_micro'] += 1
+    h.check_deal_order(h.get_deal_db(deal), deal)
+    h.update_deal_db(deal)
+    assert h.get_deal_db(deal)['current_stage'] == 4
+
+    deal['meta']['timestamp_micro'] -= 1
+    with pytest.raises(h.StaleDealEventError):
+        h.check_deal_order(h.get_deal_db(deal), deal)
+
+
+@mock_sns
+def test_failed_publish_forgets_new_deal(monkeypatch, deals_table, new_event):
+    '''A new deal whose announcement fails must not stay recorded'''
+    deal = new_event['body']
+    monkeypatch.setattr(h, 'delivery_key', lambda deal: None)
+    monkeypatch.setattr(h, 'PIPEDRIVE_SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:missing-topic')
+
+    with pytest.raises(Exception):
+        h.process_deal(deal)
+    assert not h.get_deal_db(deal)
+
+
+class FakeDeliveries:
+    '''DeliveryStore stand-in recording what happened to each key'''
+    def __init__(self):
+        self.calls = []
+
+    def claim(self, key):
+        self.calls.append(('claim', key))
+        return True
+
+    def complete(self, key):
+        self.calls.append(('complete', key))
+
+    def release(self, key):
+        self.calls.append(('release', key))
+
+
+def test_process_deal_completes_delivery(monkeypatch, update_event):
+    '''A delivery is marked done only once its workflow has finished'''
+    deliveries = FakeDeliveries()
+    monkeypatch.setattr(h, 'DELIVERIES', deliveries)
+    monkeypatch.setattr(h, 'run_deal_workflow', lambda deal: {'statusCode': 200})
+    key = h.delivery_key(update_event['body'])
+
+    assert h.process_deal(update_event['body']) == {'statusCode': 200}
+    assert deliveries.calls == [('claim', key), ('complete', key)]
+
+    def run_deal_workflow(deal):
+        raise ExternalAPIFailed('Pipedrive unavailable')
+    monkeypatch.setattr(h, 'run_deal_workflow', run_deal_workflow)
+    deliveries.calls = []
+    with pytest.raises(ExternalAPIFailed):
+        h.process_deal(update_event['body'])
+    assert deliveries.calls == [('claim', key), ('release', key)]
+
+
+def test_queue_handler_defers_rate_limited(monkeypatch):
+    '''Records that hit the rate limit should be hidden until the budget refills'''
+    deferred = []
+    def process_deal(deal):
+        raise h.RateLimitExceeded('Pipedrive rate limit reached', 2.5)
+    monkeypatch.setattr(h, 'process_deal', process_deal)
+    monkeypatch.setattr(h, 'defer_record', lambda record, delay: deferred.append((record['messageId'], delay)))
+
+    event = {'Records': [{'messageId': 'm0', 'body': json.dumps({'id': 0})}]}
+    r = h.queue_handler(event, None)
+    assert r == {'batchItemFailures': [{'itemIdentifier': 'm0'}]}
+    assert deferred == [('m0', 2.5)]
+    assert h.queue_url('arn:aws:sqs:us-east-1:123456789012:pipedrive-webhook-queue.fifo') == \
+        'https://sqs.us-east-1.amazonaws.com/123456789012/pipedrive-webhook-queue.fifo'
+
+
+def test_queue_handler_counts_failed_deferrals(monkeypatch, caplog):
+    '''A deferral SQS refuses should be reported, not silently dropped'''
+    class DeniedSQS:
+        def change_message_visibility(self, **kwargs):
+            raise h.ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'denied'}}, 'ChangeMessageVisibility')
+    def process_deal(deal):
+        raise h.RateLimitExceeded('Pipedrive rate limit reached', 2.5)
+    monkeypatch.setattr(h, 'SQS', DeniedSQS())
+    monkeypatch.setattr(h, 'process_deal', process_deal)
+
+    record = {
+        'messageId': 'm0',
+        'body': json.dumps({'id': 0}),
+        'receiptHandle': 'handle',
+        'eventSourceARN': 'arn:aws:sqs:us-east-1:123456789012:pipedrive-webhook-queue.fifo'
+    }
+    assert h.defer_record(record, 2.5) is False
+
+    r = h.queue_handler({'Records': [record]}, None)
+    assert r == {'batchItemFailures': [{'itemIdentifier': 'm0'}]}
+    assert 'Could not defer 1 rate limited record(s)' in caplog.text